@@ -0,0 +1,142 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import scoring
+from storage import CACHE_DIR, DATA_DIR, read_json, write_json_atomic
+
+
+# ======================================== ANALYTIC HIERARCHY PROCESS ======================================================= #
+#
+# Turns a pairwise comparison matrix of the five KPIs (A[i, j] = how much more important KPI i is than KPI j, on
+# Saaty's 1-9 scale) into scoring weights, with Saaty's consistency ratio to flag contradictory judgements.
+#
+# Weight profiles are named matrices plus the method used to derive the weights. The bundled "AHP.png" profile is
+# the matrix behind the original weights, which were computed with the normalised column average and rounded to
+# 3 decimals; new profiles use the principal eigenvector.
+
+BUNDLED_PROFILES_PATH = os.path.join(DATA_DIR, "ahp_profiles.json")
+PROFILES_PATH = os.path.join(CACHE_DIR, "ahp_profiles.json")
+DEFAULT_PROFILE = "AHP.png"
+
+METHODS = ["eigenvector", "column-average"]
+# Saaty's random consistency index by matrix size
+RANDOM_INDEX = {1: 0.0, 2: 0.0, 3: 0.58, 4: 0.90, 5: 1.12, 6: 1.24, 7: 1.32, 8: 1.41, 9: 1.45, 10: 1.49}
+# Judgements with a consistency ratio above this should be revised
+MAX_CONSISTENCY_RATIO = 0.1
+
+
+def validate_matrix(A):
+    A = np.asarray(A, dtype=float)
+    if A.ndim != 2 or A.shape[0] != A.shape[1]:
+        raise ValueError("The comparison matrix must be square")
+    if A.shape[0] != len(scoring.FEATURES):
+        raise ValueError(f"The comparison matrix must be {len(scoring.FEATURES)} x {len(scoring.FEATURES)}, one row per KPI")
+    if not np.all(np.isfinite(A)) or np.any(A <= 0):
+        raise ValueError("Comparison values must be positive numbers")
+    if not np.allclose(np.diag(A), 1):
+        raise ValueError("The diagonal of the comparison matrix must be 1")
+    # Hand-entered reciprocals are usually rounded (1/7 written as 0.14), so only reject clear contradictions
+    if not np.allclose(A * A.T, 1, rtol=0.1):
+        raise ValueError("The comparison matrix must be reciprocal: A[j, i] = 1 / A[i, j]")
+    return A
+
+
+def reciprocal_matrix(A):
+    # Keep the upper triangle and rebuild the lower one as exact reciprocals
+    A = np.array(A, dtype=float)
+    upper = np.triu_indices(len(A), k=1)
+    A[(upper[1], upper[0])] = 1 / A[upper]
+    np.fill_diagonal(A, 1)
+    return A
+
+
+def priority_weights(A, method="eigenvector"):
+    A = validate_matrix(A)
+    if method == "eigenvector":
+        eigenvalues, eigenvectors = np.linalg.eig(A)
+        principal = np.abs(eigenvectors[:, eigenvalues.real.argmax()].real)
+        return principal / principal.sum()
+    if method == "column-average":
+        return (A / A.sum(axis=0)).mean(axis=1)
+    raise ValueError(f"Unknown AHP method {method!r}")
+
+
+def consistency(A):
+    # (lambda_max, consistency index, consistency ratio)
+    A = validate_matrix(A)
+    n = len(A)
+    lambda_max = float(np.linalg.eigvals(A).real.max())
+    consistency_index = (lambda_max - n) / (n - 1)
+    consistency_ratio = consistency_index / RANDOM_INDEX[n] if RANDOM_INDEX[n] else 0.0
+    return lambda_max, consistency_index, consistency_ratio
+
+
+def profile_weights(profile):
+    weights = priority_weights(profile["matrix"], profile.get("method", "eigenvector"))
+    if profile.get("decimals") is not None:
+        weights = weights.round(profile["decimals"])
+    return weights
+
+
+def load_profiles():
+    # Bundled profiles first, then the user's own. Bundled profiles cannot be replaced: the default one holds the
+    # weights the CLIs and the scoring service use, and the app must score the same way
+    profiles = read_json(BUNDLED_PROFILES_PATH)
+    if os.path.exists(PROFILES_PATH):
+        profiles.update({name: profile for name, profile in read_json(PROFILES_PATH).items() if name not in profiles})
+    return profiles
+
+
+def save_profile(name, matrix, method="eigenvector"):
+    validate_matrix(matrix)
+    if method not in METHODS:
+        raise ValueError(f"Unknown AHP method {method!r}")
+    if name in read_json(BUNDLED_PROFILES_PATH):
+        raise ValueError(f"{name!r} is a bundled profile, save the matrix under another name")
+    profiles = read_json(PROFILES_PATH) if os.path.exists(PROFILES_PATH) else {}
+    profiles[name] = {"matrix": np.asarray(matrix, dtype=float).tolist(), "method": method}
+    write_json_atomic(PROFILES_PATH, profiles)
+    return profiles[name]
+
+
+def delete_profile(name):
+    profiles = read_json(PROFILES_PATH) if os.path.exists(PROFILES_PATH) else {}
+    if name not in profiles:
+        raise KeyError(f"{name!r} is not a saved profile")
+    del profiles[name]
+    write_json_atomic(PROFILES_PATH, profiles)
+
+
+def get_weights(name=DEFAULT_PROFILE):
+    return profile_weights(load_profiles()[name])
+
+
+def _kpi_frame(frame):
+    # Rows and columns put in the scoring order by KPI name, so a matrix written in another order keeps its meaning
+    for axis, labels in (("rows", frame.index), ("columns", frame.columns)):
+        labels = [str(label) for label in labels]
+        missing = [name for name in scoring.FEATURES if name not in labels]
+        unknown = [label for label in labels if label not in scoring.FEATURES]
+        if missing or unknown or len(labels) != len(set(labels)):
+            raise ValueError(f"The comparison matrix {axis} must be the KPIs {', '.join(scoring.FEATURES)} once each (missing: {missing}, unknown: {unknown})")
+    return frame.rename(index=str, columns=str).reindex(index=scoring.FEATURES, columns=scoring.FEATURES)
+
+
+def read_matrix(source):
+    # CSV with the KPIs as header and index, in any order, or JSON in the scoring order (a list of rows or
+    # {"matrix": [...]}); accepts a path or file object
+    name = getattr(source, "name", source)
+    if str(name).lower().endswith(".json"):
+        import json
+
+        data = json.load(source) if hasattr(source, "read") else read_json(source)
+        matrix = data["matrix"] if isinstance(data, dict) else data
+    else:
+        matrix = _kpi_frame(pd.read_csv(source, index_col=0)).to_numpy()
+    return validate_matrix(matrix)
+
+
+def matrix_frame(A):
+    return pd.DataFrame(np.asarray(A, dtype=float), index=scoring.FEATURES, columns=scoring.FEATURES)
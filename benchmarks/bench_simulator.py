@@ -0,0 +1,420 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+# Benchmarks must not touch the app's real caches
+os.environ.setdefault("SCR_CACHE_DIR", tempfile.mkdtemp(prefix="scr-bench-"))
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import numpy as np
+import pandas as pd
+
+import country_risk
+import fixtures
+import portfolio
+import scaler_model
+import scoring
+import streaming
+import targets
+from score_index import ScoreIndex
+
+
+# ======================================== SIMULATE PATH BENCHMARKS ======================================================= #
+#
+# Times every stage of a simulation on its own and end to end, against the local HTML fixtures and synthetic
+# portfolios, with peak traced memory per stage. Results are written to benchmarks/results/ and compared with the
+# stored baseline; any stage slower than the baseline by more than the tolerance is flagged as a regression, and
+# stages missing from the baseline are listed as not checked. --save-baseline updates only the stages that ran.
+#
+#     python benchmarks/bench_simulator.py                       # all stages, default sizes
+#     python benchmarks/bench_simulator.py --sizes 300,10000 --stages scoring,targets
+#     python benchmarks/bench_simulator.py --save-baseline
+
+DEFAULT_SIZES = [300, 10_000, 100_000, 1_000_000]
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+# Stages that are only meaningful (or bearable) on smaller portfolios
+EXCEL_MAX_ROWS = 10_000
+LEGACY_MAX_ROWS = 10_000
+IN_MEMORY_CSV_MAX_ROWS = 100_000
+# Differences below this are timer noise, not regressions
+NOISE_FLOOR_S = 0.001
+
+SIMULATED_SUPPLIER = {"Lead Time": 38, "Distance (km)": 837.4, "BCP_risk": "MEDIUM", "Supplier Country": "China"}
+
+
+def measure(fn, repeat):
+    # Median / min wall time over repeat runs, then one extra traced run for peak memory
+    fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"median_s": statistics.median(timings), "min_s": min(timings), "peak_mb": peak / 2 ** 20, "repeat": repeat}
+
+
+def legacy_targets(df):
+    # The five row-wise df.apply passes the simulator used before the closed-form solver, kept for comparison
+    weights, (low, high) = scoring.WEIGHTS, scoring.THRESHOLDS
+    for j, column in enumerate(scoring.REQUIRED_SCALED):
+        others = [k for k in range(5) if k != j]
+
+        def required(row, j=j, others=others):
+            rest = sum(-weights[k] * row[scoring.SCALED_FEATURES[k]] for k in others)
+            if row['SCR_Strength'] == 0:
+                return (low - rest) / (-weights[j])
+            if row['SCR_Strength'] == 1:
+                return (high - rest) / (-weights[j])
+            return ""
+
+        df[column] = pd.to_numeric(df.apply(required, axis=1), errors='coerce')
+    return df
+
+
+def global_stages(fixture_urls):
+    fragility_html, natural_disaster_html = fixtures.read_html_fixtures()
+    snapshot = country_risk.load_snapshot()
+    fragility_url, natural_disaster_url = fixture_urls
+    session = country_risk.make_session()
+    fragility, natural_disaster, validators, _ = country_risk.fetch_country_risks(fragility_url, natural_disaster_url, session=session)
+    previous = {"fragility": fragility, "natural_disaster": natural_disaster, "validators": validators}
+
+    def fetch_local():
+        # Both pages downloaded and parsed over the local stand-in server
+        country_risk.fetch_country_risks(fragility_url, natural_disaster_url, session=session)
+
+    def fetch_local_not_modified():
+        # Revalidating an unchanged snapshot: both pages answer 304
+        country_risk.fetch_country_risks(fragility_url, natural_disaster_url, previous, session=session)
+
+    return [
+        ("country_risk.parse", lambda: country_risk.parse_country_risks(fragility_html, natural_disaster_html)),
+        ("country_risk.fetch_local", fetch_local),
+        ("country_risk.fetch_local_not_modified", fetch_local_not_modified),
+        ("country_risk.lookup", lambda: country_risk.lookup_country(SIMULATED_SUPPLIER["Supplier Country"], snapshot)),
+    ]
+
+
+# First page of the app in a fresh interpreter, as a newly started server process would render it
+FIRST_PAINT_SCRIPT = """
+import logging, sys
+logging.disable(logging.WARNING)
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+at.run()
+sys.exit(1 if at.exception else 0)
+"""
+
+
+def _streamlit_internal(obj, name):
+    # The render stages rely on Streamlit internals; if an upgrade moves them the benchmark must fail rather than
+    # quietly time something else
+    import streamlit
+
+    if not hasattr(obj, name):
+        raise RuntimeError(f"{getattr(obj, '__name__', type(obj).__name__)}.{name} is gone in Streamlit {streamlit.__version__}, the render stages need updating")
+    return getattr(obj, name)
+
+
+@contextlib.contextmanager
+def render_stages():
+    # Yields the render stages; the Streamlit patches they need are undone on exit
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        yield []
+        return
+    import dataclasses
+    import functools
+    import itertools
+    import logging
+    import subprocess
+
+    import streamlit
+    from streamlit.runtime.scriptrunner import RerunData
+    from streamlit.testing.v1 import local_script_runner
+
+    app_path = os.path.join(os.path.dirname(BENCH_DIR), "streamlit_simulator.py")
+
+    # AppTest has no fragment reruns, so interact() queues the fragments through the RerunData the test runner creates
+    if _streamlit_internal(local_script_runner, "RerunData") is not RerunData or "fragment_id_queue" not in {f.name for f in dataclasses.fields(RerunData)}:
+        raise RuntimeError(f"AppTest reruns cannot be scoped to fragments in Streamlit {streamlit.__version__}, the render stages need updating")
+
+
+    def quietly(fn):
+        # Streamlit logs a warning with a stack trace for every empty metric label; keep the report readable
+        def wrapper():
+            logging.disable(logging.WARNING)
+            try:
+                return fn()
+            finally:
+                logging.disable(logging.NOTSET)
+        return wrapper
+
+    def fill(at):
+        at.number_input[0].set_value(SIMULATED_SUPPLIER["Lead Time"])
+        at.number_input[1].set_value(SIMULATED_SUPPLIER["Distance (km)"])
+        at.selectbox[0].select(SIMULATED_SUPPLIER["BCP_risk"])
+        at.selectbox[1].select(SIMULATED_SUPPLIER["Supplier Country"])
+
+    def interact(at):
+        # The rerun the browser requests after a widget change on the calculator page, which is a fragment: only the
+        # fragment runs. AppTest only does full reruns, so the rerun request is patched.
+        fragment_ids = list(_streamlit_internal(_streamlit_internal(at, "_fragment_storage"), "_fragments"))
+        if not fragment_ids:
+            raise RuntimeError("The calculator page registered no fragment, render.interaction would time a full rerun")
+        local_script_runner.RerunData = functools.partial(RerunData, fragment_id_queue=fragment_ids)
+        try:
+            at.run()
+        finally:
+            local_script_runner.RerunData = RerunData
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+
+    def click_simulate(at, rerun=None):
+        next(button for button in at.button if button.label == "Simulate").click()
+        (rerun or AppTest.run)(at)
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+
+    def first_paint_cold():
+        # Time to first paint from process start, streamlit import included
+        subprocess.run([sys.executable, "-c", FIRST_PAINT_SCRIPT, app_path], check=True, capture_output=True)
+
+    def simulate():
+        # New session: first render, fill in the form, simulate
+        at = AppTest.from_file(app_path, default_timeout=120)
+        at.run()
+        fill(at)
+        click_simulate(at)
+
+    @quietly
+    def warm_session():
+        at = AppTest.from_file(app_path, default_timeout=120)
+        at.run()
+        fill(at)
+        at.run()
+        return at
+
+    def interaction():
+        # One input changed in a warm session
+        warm.number_input[0].set_value(next(lead_times))
+        interact(warm)
+
+    # A server compiles the script once per process, AppTest on every run; share one script cache so the
+    # in-process stages time the script and not the compiler. The cold first paint still compiles.
+    script_cache_class = _streamlit_internal(local_script_runner, "ScriptCache")
+    script_cache = script_cache_class()
+    local_script_runner.ScriptCache = lambda: script_cache
+    try:
+        warm = warm_session()
+        lead_times = itertools.cycle([SIMULATED_SUPPLIER["Lead Time"] + 1, SIMULATED_SUPPLIER["Lead Time"]])
+        yield [
+            ("render.first_paint_cold", first_paint_cold),
+            ("render.simulate", quietly(simulate)),
+            ("render.interaction", quietly(interaction)),
+            ("render.simulate_warm", quietly(lambda: click_simulate(warm, interact))),
+        ]
+    finally:
+        local_script_runner.ScriptCache = script_cache_class
+
+
+def _known_countries(n, snapshot):
+    # Countries present in both risk tables, so every row can be scored from its country alone
+    names = np.array(sorted(set(snapshot["fragility"]) & set(snapshot["natural_disaster"])))
+    return names[np.random.default_rng(0).integers(0, len(names), n)]
+
+
+def sized_stages(n, workdir):
+    df = fixtures.synthetic_portfolio(n)
+    X = scoring.feature_matrix(df)
+    model = scaler_model.fit_model(X)
+    mean, scale = scaler_model.model_scaler(model)
+    new_rows = X[: max(1, n // 100)]
+    Z = scoring.transform(X, mean, scale)
+    scores = scoring.score(Z)
+    strengths = scoring.strength(scores)
+    index = ScoreIndex(scores, strengths, df["Supplier Country"].to_numpy())
+    queries = np.random.default_rng(0).normal(0, 0.7, 1000)
+
+    supplier = pd.DataFrame([SIMULATED_SUPPLIER])
+    snapshot = country_risk.load_snapshot()
+
+    def simulate_one(index):
+        # What run_script computes for one supplier, minus rendering
+        row = scoring.attach_country_risks(supplier)
+        Z0 = scoring.transform(scoring.feature_matrix(row), mean, scale)
+        score0 = scoring.score(Z0)
+        strength0 = scoring.strength(score0)
+        targets.solve_targets(Z0, score0, strength0, mean, scale, scoring.WEIGHTS, scoring.THRESHOLDS)
+        return index.percentile(score0)
+
+    stages = []
+    if n <= EXCEL_MAX_ROWS:
+        excel_path = os.path.join(workdir, f"portfolio_{n}.xlsx")
+        df[scoring.FEATURES].to_excel(excel_path, index=False)
+        portfolio.load_portfolio(excel_path)
+        stages.append(("portfolio.read_excel", lambda: pd.read_excel(excel_path)))
+        stages.append(("portfolio.load_cached", lambda: portfolio.load_portfolio(excel_path)))
+
+    # The same rows as a CSV with countries instead of risk values, scored in memory and streamed in chunks
+    csv_path = os.path.join(workdir, f"portfolio_{n}.csv")
+    output_path = os.path.join(workdir, f"scored_{n}.csv")
+    df.drop(columns=streaming.RISK_COLUMNS).assign(**{"Supplier Country": _known_countries(n, snapshot)}).to_csv(csv_path, index=False)
+    countries = streaming.CountryCodes(snapshot)
+
+    def score_csv_in_memory():
+        scoring.score_frame(scoring.attach_country_risks(pd.read_csv(csv_path)), scaler=(mean, scale)).to_csv(output_path, index=False)
+
+    def end_to_end_cold():
+        # Fresh process state: score the whole portfolio and build its index before ranking the supplier
+        result = scoring.score_frame(df, scaler=(mean, scale))
+        simulate_one(ScoreIndex(result["SCR_score"].to_numpy(), result["SCR_Strength"].to_numpy()))
+
+    stages += [
+        ("scaler.fit", lambda: scaler_model.fit_model(X)),
+        ("scaler.update", lambda: scaler_model.update_model(model, new_rows)),
+        ("scoring.score", lambda: scoring.strength(scoring.score(scoring.transform(X, mean, scale)))),
+        ("scoring.score_frame", lambda: scoring.score_frame(df, scaler=(mean, scale))),
+        ("targets.solve", lambda: targets.solve_targets(Z, scores, strengths, mean, scale, scoring.WEIGHTS, scoring.THRESHOLDS)),
+        ("score_index.build", lambda: ScoreIndex(scores, strengths, df["Supplier Country"].to_numpy())),
+        ("score_index.query_1000", lambda: index.percentile(queries)),
+        ("streaming.score_csv", lambda: streaming.score_file(csv_path, output_path, (mean, scale), countries=countries)),
+        ("end_to_end.cold", end_to_end_cold),
+        ("end_to_end.warm", lambda: simulate_one(index)),
+    ]
+    if n <= IN_MEMORY_CSV_MAX_ROWS:
+        stages.append(("scoring.score_csv_in_memory", score_csv_in_memory))
+    if n <= LEGACY_MAX_ROWS:
+        frame = pd.DataFrame(Z, columns=scoring.SCALED_FEATURES)
+        frame["SCR_Strength"] = strengths
+        stages.append(("targets.legacy_apply", lambda: legacy_targets(frame.copy())))
+    return stages
+
+
+def run(sizes, stage_filter, repeat, render):
+    results = []
+
+    def record(name, rows, fn):
+        if stage_filter and not any(f in name for f in stage_filter):
+            return
+        reps = repeat if rows is None or rows < 1_000_000 else max(1, repeat // 2)
+        result = {"stage": name, "rows": rows, **measure(fn, reps)}
+        results.append(result)
+        rows_label = "-" if rows is None else f"{rows:,}"
+        print(f"{name:<40} {rows_label:>10} {result['median_s'] * 1000:>12.3f} ms {result['peak_mb']:>10.1f} MB", flush=True)
+
+    print(f"{'stage':<40} {'rows':>10} {'median':>15} {'peak mem':>13}")
+    with fixtures.serve_fixtures() as fixture_urls:
+        for name, fn in global_stages(fixture_urls):
+            record(name, None, fn)
+    if render:
+        with render_stages() as stages:
+            for name, fn in stages:
+                record(name, None, fn)
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in sizes:
+            for name, fn in sized_stages(n, workdir):
+                record(name, n, fn)
+    return results
+
+
+def stage_label(result):
+    return result["stage"] if result["rows"] is None else f"{result['stage']} ({result['rows']} rows)"
+
+
+def compare(results, baseline, tolerance):
+    # Stages slower than baseline * (1 + tolerance), ignoring differences within timer noise, and the stages the
+    # baseline has no entry for, which cannot be checked at all
+    reference = {(r["stage"], r["rows"]): r for r in baseline["results"]}
+    regressions, unchecked = [], []
+    for result in results:
+        base = reference.get((result["stage"], result["rows"]))
+        if base is None:
+            unchecked.append(result)
+        elif result["median_s"] > base["median_s"] * (1 + tolerance) and result["median_s"] - base["median_s"] > NOISE_FLOOR_S:
+            regressions.append((result, base))
+    return regressions, unchecked
+
+
+def merge_baseline(baseline, report):
+    # The new results replace the baseline's entries for the same stages and sizes and the rest are kept, so new
+    # stages can be baselined with --stages without re-timing everything else
+    updated = {(r["stage"], r["rows"]) for r in report["results"]}
+    kept = [r for r in baseline["results"] if (r["stage"], r["rows"]) not in updated] if baseline else []
+    return {"meta": report["meta"], "results": kept + report["results"]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the simulate path stage by stage, fully offline.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Comma-separated synthetic portfolio sizes")
+    parser.add_argument("--stages", help="Comma-separated substrings; only stages matching one of them run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-render", action="store_true", help="Skip the Streamlit rendering stage")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline before flagging (0.25 = 25%%)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the stages of this run in the baseline, keeping the other stages' entries")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    stage_filter = args.stages.split(",") if args.stages else None
+    results = run(sizes, stage_filter, args.repeat, not args.no_render)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_path = os.path.join(RESULTS_DIR, f"bench-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(results_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {results_path}")
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(merge_baseline(baseline, report), f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print("No baseline to compare against, run with --save-baseline first")
+        return 0
+    regressions, unchecked = compare(results, baseline, args.tolerance)
+    for result, base in regressions:
+        print(f"REGRESSION {stage_label(result)}: {result['median_s'] * 1000:.3f} ms vs baseline {base['median_s'] * 1000:.3f} ms")
+    for result in unchecked:
+        print(f"NO BASELINE {stage_label(result)}: not checked, add it with --save-baseline --stages {result['stage']}")
+    if not regressions:
+        print(f"No regressions against the baseline (tolerance {args.tolerance:.0%})" + (f", {len(unchecked)} stages not checked" if unchecked else ""))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# The checks write snapshots and must not touch the app's real caches
+os.environ.setdefault("SCR_CACHE_DIR", tempfile.mkdtemp(prefix="scr-check-"))
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import country_risk
+import fixtures
+
+
+# ======================================== COUNTRY RISK REFRESH CHECKS ======================================================= #
+#
+# Runs the snapshot refresh against the local stand-in server and checks what went over the wire and what ended up
+# on disk: retries of failing requests, the 304 path of an unchanged page, a changed page and a background refresh
+# that runs out of retries. Exits with 1 if any check fails.
+#
+#     python benchmarks/check_country_risk.py
+
+
+def _fixture_validators():
+    validators = {}
+    for key, path in (("fragility", fixtures.FRAGILITY_FIXTURE), ("natural_disaster", fixtures.NATURAL_DISASTER_FIXTURE)):
+        stat = os.stat(path)
+        validators[key] = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    return validators
+
+
+def _expect(failures, name, condition, detail=""):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}" + (f": {detail}" if detail and not condition else ""))
+    if not condition:
+        failures.append(name)
+
+
+def _refresh_in_background(fixture_urls):
+    # refresh_in_background() always refreshes from Wikipedia, so it is pointed at the stand-in server for the check
+    refresh = country_risk.refresh_snapshot
+    country_risk.refresh_snapshot = lambda: refresh(*fixture_urls)
+    try:
+        thread = country_risk.refresh_in_background(force=True)
+        thread.join()
+    finally:
+        country_risk.refresh_snapshot = refresh
+    return country_risk.refresh_status()
+
+
+def run_checks():
+    failures = []
+    expected = country_risk.parse_country_risks(*fixtures.read_html_fixtures())
+    seed = country_risk.load_snapshot()
+    stats = {}
+
+    with fixtures.serve_fixtures(failures=2, stats=stats) as fixture_urls:
+        # First refresh: two 503s are retried, then both pages are downloaded
+        first = country_risk.refresh_snapshot(*fixture_urls, session=country_risk.make_session())
+        etags = {key: value["etag"] for key, value in first["validators"].items()}
+        _expect(failures, "retries: 503s are retried until both pages arrive", stats["requests"] == 4, f"{stats['requests']} requests")
+        _expect(failures, "retries: the tables are the fixture tables", (first["fragility"], first["natural_disaster"]) == expected)
+        _expect(failures, "retries: a new snapshot version is stored", first["version"] == seed["version"] + 1, f"version {first['version']}")
+        _expect(failures, "retries: the validators are the server's ETags", etags == _fixture_validators(), str(etags))
+        _expect(failures, "retries: the snapshot is saved", country_risk.load_snapshot() == first)
+
+        # Unchanged pages: both answer 304, the version is kept and only the fetch date moves
+        time.sleep(0.01)
+        requests = stats["requests"]
+        second = country_risk.refresh_snapshot(*fixture_urls, session=country_risk.make_session())
+        _expect(failures, "not modified: one request per page", stats["requests"] - requests == 2, f"{stats['requests'] - requests} requests")
+        _expect(failures, "not modified: the version is kept", second["version"] == first["version"], f"version {second['version']}")
+        _expect(failures, "not modified: the fetch date moves", second["fetched_at"] > first["fetched_at"])
+        _expect(failures, "not modified: tables and validators are kept", all(second[key] == first[key] for key in ("fragility", "natural_disaster", "validators")))
+        _expect(failures, "not modified: the snapshot is saved", country_risk.load_snapshot() == second)
+
+        # A changed page is downloaded again by the background refresh and gives a new version
+        stat = os.stat(fixtures.FRAGILITY_FIXTURE)
+        os.utime(fixtures.FRAGILITY_FIXTURE, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        try:
+            requests = stats["requests"]
+            running, error = _refresh_in_background(fixture_urls)
+            third = country_risk.load_snapshot()
+            _expect(failures, "background: the refresh finishes without error", not running and error is None, str(error))
+            _expect(failures, "background: one request per page", stats["requests"] - requests == 2, f"{stats['requests'] - requests} requests")
+            _expect(failures, "background: the changed page gives a new version", third["version"] == second["version"] + 1, f"version {third['version']}")
+            _expect(failures, "background: the changed page's validator is updated", third["validators"]["fragility"]["etag"] == _fixture_validators()["fragility"])
+            _expect(failures, "background: the unchanged page's validator is kept", third["validators"]["natural_disaster"] == second["validators"]["natural_disaster"])
+            _expect(failures, "background: the snapshot in memory is the saved one", country_risk.get_snapshot() == third)
+        finally:
+            os.utime(fixtures.FRAGILITY_FIXTURE, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        # Out of retries: every attempt of both pages fails and the previous snapshot is kept
+        attempts = 2 * (country_risk.REQUEST_RETRIES + 1)
+        with stats["lock"]:
+            stats["failures"] = attempts
+        requests = stats["requests"]
+        running, error = _refresh_in_background(fixture_urls)
+        _expect(failures, "out of retries: every attempt is made", stats["requests"] - requests == attempts, f"{stats['requests'] - requests} requests")
+        _expect(failures, "out of retries: the error is reported", not running and error is not None and "RetryError" in error, str(error))
+        _expect(failures, "out of retries: the previous snapshot is kept", country_risk.load_snapshot() == third and country_risk.get_snapshot() == third)
+
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the country risk refresh against the local stand-in server.")
+    parser.parse_args(argv)
+
+    failures = run_checks()
+    print(f"\n{len(failures)} checks failed" if failures else "\nAll checks passed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import contextlib
+import functools
+import html
+import os
+import sys
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import country_risk
+import scoring
+
+
+# ======================================== BENCHMARK FIXTURES ======================================================= #
+#
+# Offline stand-ins for the two Wikipedia pages and synthetic portfolios of any size, so every stage of the simulate
+# path can be measured without network access.
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FRAGILITY_FIXTURE = os.path.join(FIXTURES_DIR, "fragile_states_index.html")
+NATURAL_DISASTER_FIXTURE = os.path.join(FIXTURES_DIR, "natural_disaster_risk.html")
+
+
+def _page(title, header, rows, filler_paragraphs=150):
+    # Roughly the shape of a Wikipedia article: navigation, prose, an unrelated table, the sortable wikitable and
+    # navboxes, so parse timings are in the right ballpark
+    prose = "".join(
+        f"<p>Paragraph {i} of the article body with <a href=\"/wiki/Link_{i}\">links</a>, <sup class=\"reference\"><a href=\"#cite_note-{i}\">[{i}]</a></sup> citations and <b>formatting</b>.</p>\n"
+        for i in range(filler_paragraphs)
+    )
+    navigation = "".join(f"<li><a href=\"/wiki/Nav_{i}\">Navigation item {i}</a></li>" for i in range(300))
+    header_html = "".join(f"<th>{html.escape(h)}</th>" for h in header)
+    body = "\n".join("<tr>" + "".join(f"<td>{cell}</td>" for cell in row) + "</tr>" for row in rows)
+    return f"""<!DOCTYPE html>
+<html><head><title>{html.escape(title)} - Wikipedia</title></head>
+<body>
+<div id="mw-navigation"><ul>{navigation}</ul></div>
+<div id="content"><h1>{html.escape(title)}</h1>
+<table class="infobox"><tr><th>Published</th><td>Yearly</td></tr></table>
+{prose}
+<table class="wikitable sortable">
+<tr>{header_html}</tr>
+{body}
+</table>
+{prose}
+<table class="navbox"><tr><td>{navigation}</td></tr></table>
+</div></body></html>
+"""
+
+
+def _country_cell(country):
+    slug = html.escape(country.replace(" ", "_"))
+    return f"<span class=\"flagicon\"><img src=\"//upload.wikimedia.org/{slug}.svg\" width=\"23\" height=\"15\"></span> <a href=\"/wiki/{slug}\" title=\"{html.escape(country)}\">{html.escape(country)}</a>"
+
+
+def write_html_fixtures(snapshot=None):
+    snapshot = snapshot or country_risk.load_snapshot()
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+
+    fragility = sorted(snapshot["fragility"].items(), key=lambda item: -item[1])
+    rows = [(rank, _country_cell(country), f"{score:.1f}", f"{score / 12:.1f}", f"{score / 11:.1f}") for rank, (country, score) in enumerate(fragility, 1)]
+    with open(FRAGILITY_FIXTURE, "w", encoding="utf-8") as f:
+        f.write(_page("List of countries by Fragile States Index", ["Rank", "Country", "Total", "Security", "Economy"], rows))
+
+    natural_disaster = sorted(snapshot["natural_disaster"].items(), key=lambda item: -item[1])
+    rows = [(rank, _country_cell(country), f"{score:.2f}%", f"{score * 1.7:.2f}%", f"{score * 0.6:.2f}%") for rank, (country, score) in enumerate(natural_disaster, 1)]
+    with open(NATURAL_DISASTER_FIXTURE, "w", encoding="utf-8") as f:
+        f.write(_page("List of countries by natural disaster risk", ["Rank", "Country", "WorldRiskIndex", "Exposure", "Vulnerability"], rows))
+
+
+def read_html_fixtures():
+    with open(FRAGILITY_FIXTURE, encoding="utf-8") as f1, open(NATURAL_DISASTER_FIXTURE, encoding="utf-8") as f2:
+        return f1.read(), f2.read()
+
+
+class _FixtureHandler(SimpleHTTPRequestHandler):
+    # Serves the fixture pages with ETag / Last-Modified validators and answers conditional requests with 304, like
+    # Wikipedia does. The first `failures` requests get a 503 so client retries can be exercised.
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, *args, server_state, **kwargs):
+        self.server_state = server_state
+        super().__init__(*args, **kwargs)
+
+    def _etag(self, path):
+        stat = os.stat(path)
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def send_head(self):
+        with self.server_state["lock"]:
+            self.server_state["requests"] += 1
+            failing = self.server_state["failures"] > 0
+            if failing:
+                self.server_state["failures"] -= 1
+        if failing:
+            self.send_error(503, "Service Unavailable")
+            return None
+        path = self.translate_path(self.path)
+        if os.path.isfile(path) and self.headers.get("If-None-Match") == self._etag(path):
+            self.send_response(304)
+            self.send_header("ETag", self._etag(path))
+            self.end_headers()
+            return None
+        return super().send_head()
+
+    def end_headers(self):
+        path = self.translate_path(self.path)
+        if os.path.isfile(path):
+            self.send_header("ETag", self._etag(path))
+        super().end_headers()
+
+    def guess_type(self, path):
+        return "text/html; charset=utf-8" if path.endswith(".html") else super().guess_type(path)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve_fixtures(failures=0, stats=None):
+    # Local HTTP stand-in for Wikipedia serving the fixture pages; yields (fragility URL, natural disaster URL).
+    # Pass a dict as stats to get the number of requests served in stats["requests"].
+    state = stats if stats is not None else {}
+    state.update(requests=0, failures=failures, lock=threading.Lock())
+    handler = functools.partial(_FixtureHandler, directory=FIXTURES_DIR, server_state=state)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        yield f"{base_url}/{os.path.basename(FRAGILITY_FIXTURE)}", f"{base_url}/{os.path.basename(NATURAL_DISASTER_FIXTURE)}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def synthetic_portfolio(n, seed=0):
+    # n rows resampled from the reference portfolio with a little jitter, so the KPI distributions look real
+    reference = pd.read_excel(scoring.PORTFOLIO_PATH)
+    rng = np.random.default_rng(seed)
+    rows = reference.iloc[rng.integers(0, len(reference), n)].reset_index(drop=True)
+    jitter = rng.normal(1, 0.05, (n, 4))
+    for j, name in enumerate(scoring.FEATURES[:4]):
+        rows[name] = np.maximum(rows[name].to_numpy(dtype=float) * jitter[:, j], 0)
+    countries = np.array(sorted(country_risk.load_snapshot()["natural_disaster"]))
+    rows["Supplier Country"] = countries[rng.integers(0, len(countries), n)]
+    return rows[scoring.FEATURES + ["Supplier Country"]]
+
+
+if __name__ == "__main__":
+    write_html_fixtures()
+    print(f"Wrote {FRAGILITY_FIXTURE} and {NATURAL_DISASTER_FIXTURE}")
@@ -0,0 +1,192 @@
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import numpy as np
+
+import country_risk
+
+
+# ======================================== SCORING SERVICE LOAD TEST ======================================================= #
+#
+# Starts scoring_service.py locally (or targets a running one with --url) and drives it from several client
+# processes, each with a few keep-alive connections, reporting throughput and latency percentiles.
+#
+#     python benchmarks/load_test.py --endpoint score --requests 20000 --concurrency 64
+#     python benchmarks/load_test.py --endpoint batch --batch-size 500 --workers 4
+#     python benchmarks/load_test.py --url http://scoring-host:8765 --endpoint targets
+
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+PATHS = {"score": "/score", "targets": "/targets", "batch": "/score/batch"}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_ready(url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/health", timeout=2) as response:
+                return json.load(response)
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Scoring service at {url} did not come up within {timeout} s")
+
+
+def start_service(workers, max_batch_wait):
+    # Scoring service in a child process with its own throwaway cache directory; returns (process, base URL)
+    port = _free_port()
+    env = dict(os.environ, SCR_CACHE_DIR=os.environ.get("SCR_CACHE_DIR") or tempfile.mkdtemp(prefix="scr-load-"))
+    command = [sys.executable, os.path.join(os.path.dirname(BENCH_DIR), "scoring_service.py"), "--port", str(port), "--workers", str(workers), "--max-batch-wait", str(max_batch_wait)]
+    process = subprocess.Popen(command, env=env)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_until_ready(url)
+    except BaseException:
+        process.terminate()
+        raise
+    return process, url
+
+
+def make_bodies(endpoint, n, batch_size, seed=0):
+    # Random but realistic suppliers, by country, encoded once up front so the clients only send bytes
+    rng = np.random.default_rng(seed)
+    snapshot = country_risk.load_snapshot()
+    countries = sorted(set(snapshot["fragility"]) & set(snapshot["natural_disaster"]))
+    bcp = ["LOW", "MEDIUM", "HIGH"]
+
+    def supplier():
+        return {
+            "Lead Time": float(rng.gamma(2, 15)),
+            "Distance (km)": float(rng.gamma(1.5, 600)),
+            "BCP_risk": bcp[rng.integers(3)],
+            "Supplier Country": countries[rng.integers(len(countries))],
+        }
+
+    if endpoint == "batch":
+        return [json.dumps({"suppliers": [supplier() for _ in range(batch_size)]}).encode() for _ in range(min(n, 64))]
+    return [json.dumps(supplier()).encode() for _ in range(min(n, 1024))]
+
+
+def _client(args):
+    # One client process: `connections` threads, each sending its share of requests over one keep-alive connection
+    url, path, bodies, requests, connections = args
+    parsed = urllib.parse.urlparse(url)
+    latencies = [[] for _ in range(connections)]
+    errors = [0] * connections
+
+    def worker(k):
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=60)
+        headers = {"Content-Type": "application/json"}
+        for i in range(k, requests, connections):
+            body = bodies[i % len(bodies)]
+            start = time.perf_counter()
+            try:
+                connection.request("POST", path, body, headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors[k] += 1
+            except (OSError, http.client.HTTPException):
+                errors[k] += 1
+                connection.close()
+                connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=60)
+                continue
+            latencies[k].append(time.perf_counter() - start)
+        connection.close()
+
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [x for per_thread in latencies for x in per_thread], sum(errors)
+
+
+def run_load(url, endpoint, requests, concurrency, clients, batch_size):
+    bodies = make_bodies(endpoint, requests, batch_size)
+    clients = max(1, min(clients, concurrency))
+    shares = [requests // clients + (1 if i < requests % clients else 0) for i in range(clients)]
+    connections = [concurrency // clients + (1 if i < concurrency % clients else 0) for i in range(clients)]
+    jobs = [(url, PATHS[endpoint], bodies, shares[i], connections[i]) for i in range(clients)]
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(_client, jobs)
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([x for result in results for x in result[0]])
+    errors = sum(result[1] for result in results)
+    rows_per_request = batch_size if endpoint == "batch" else 1
+    return {
+        "endpoint": endpoint,
+        "requests": requests,
+        "concurrency": concurrency,
+        "clients": clients,
+        "batch_size": rows_per_request,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "requests_per_s": len(latencies) / elapsed,
+        "suppliers_per_s": len(latencies) * rows_per_request / elapsed,
+        "latency_ms": {f"p{p}": float(np.percentile(latencies, p) * 1000) for p in (50, 90, 99)} | {"max": float(latencies.max() * 1000)} if len(latencies) else {},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the scoring service locally.")
+    parser.add_argument("--url", help="Base URL of a running service; by default one is started for the test")
+    parser.add_argument("--endpoint", choices=sorted(PATHS), default="score")
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=64, help="Open keep-alive connections in total")
+    parser.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="Client processes the connections are spread over")
+    parser.add_argument("--batch-size", type=int, default=100, help="Suppliers per request for --endpoint batch")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="Service worker processes when the service is started here")
+    parser.add_argument("--max-batch-wait", type=float, default=0.0)
+    parser.add_argument("--warmup", type=int, default=500, help="Requests sent before measuring")
+    args = parser.parse_args(argv)
+
+    process = None
+    url = args.url
+    if url is None:
+        process, url = start_service(args.workers, args.max_batch_wait)
+    try:
+        if args.warmup:
+            run_load(url, args.endpoint, args.warmup, args.concurrency, args.clients, args.batch_size)
+        report = run_load(url, args.endpoint, args.requests, args.concurrency, args.clients, args.batch_size)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report["service_workers"] = None if args.url else args.workers
+    report["timestamp"] = datetime.now(timezone.utc).isoformat()
+    report["cpus"] = os.cpu_count()
+    print(json.dumps(report, indent=2))
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"load-{args.endpoint}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {path}", file=sys.stderr)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import instrumentation
+from storage import CACHE_DIR, DATA_DIR, read_json, write_json_atomic
+
+
+# ======================================== COUNTRY RISK SNAPSHOTS ======================================================= #
+#
+# The Fragility Index and Natural Disaster Risk tables are kept on disk as a versioned JSON snapshot so the simulator
+# never has to reach Wikipedia while a user is waiting. A seed snapshot ships with the repo; refreshed snapshots are
+# written to the cache directory and take precedence over the seed.
+#
+# A refresh fetches both pages at once over one pooled HTTP session with timeouts and retries, and sends the ETag /
+# Last-Modified validators of the previous fetch so an unchanged page costs a 304 instead of a download. Pages are
+# streamed and the download stops as soon as the target table has been received; only that table is parsed.
+
+SEED_SNAPSHOT_PATH = os.path.join(DATA_DIR, "country_risk_seed.json")
+SNAPSHOT_PATH = os.path.join(CACHE_DIR, "country_risk.json")
+
+FRAGILITY_URL = "https://en.wikipedia.org/wiki/List_of_countries_by_Fragile_States_Index"
+NATURAL_DISASTER_URL = "https://en.wikipedia.org/wiki/List_of_countries_by_natural_disaster_risk"
+
+# Snapshots older than this are refreshed in the background the next time they are requested
+SNAPSHOT_TTL = timedelta(days=int(os.environ.get("SCR_COUNTRY_RISK_TTL_DAYS", "30")))
+# Minimum gap between two background refresh attempts, so an offline machine does not retry on every click
+REFRESH_RETRY_INTERVAL = timedelta(hours=1)
+# (connect, read) timeouts in seconds and retries per request for the refresh
+REQUEST_TIMEOUT = (5, 30)
+REQUEST_RETRIES = 3
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Start of the table the scores are read from, and the tags needed to find where it ends
+_TABLE_START = re.compile(rb'<table[^>]*class="wikitable sortable"', re.IGNORECASE)
+_TABLE_TAG = re.compile(rb"<(/?)table\b", re.IGNORECASE)
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+_refresh_thread = None
+_last_refresh_attempt = None
+_last_refresh_error = None
+_session = None
+
+
+def load_snapshot():
+    # Latest refreshed snapshot if there is one, otherwise the bundled seed
+    if os.path.exists(SNAPSHOT_PATH):
+        try:
+            return read_json(SNAPSHOT_PATH)
+        except (OSError, ValueError):
+            pass
+    return read_json(SEED_SNAPSHOT_PATH)
+
+
+def save_snapshot(snapshot):
+    write_json_atomic(SNAPSHOT_PATH, snapshot)
+
+
+def snapshot_age(snapshot, now=None):
+    # The seed has no fetch date, so it is treated as infinitely old
+    if not snapshot.get("fetched_at"):
+        return None
+    now = now or datetime.now(timezone.utc)
+    return now - datetime.fromisoformat(snapshot["fetched_at"])
+
+
+def is_stale(snapshot, ttl=SNAPSHOT_TTL):
+    age = snapshot_age(snapshot)
+    return age is None or age > ttl
+
+
+def _table_bounds(data):
+    # (start, end) byte offsets of the first "wikitable sortable" table, nested tables included, or None while the
+    # table has not been fully received
+    start = _TABLE_START.search(data)
+    if start is None:
+        return None
+    depth = 0
+    for tag in _TABLE_TAG.finditer(data, start.start()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            end = data.find(b">", tag.end())
+            return (start.start(), end + 1) if end != -1 else None
+    return None
+
+
+def parse_wikitable(html, encoding="utf-8"):
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    data = html.encode(encoding) if isinstance(html, str) else html
+    bounds = _table_bounds(data)
+    if bounds is not None:
+        # Only the table itself goes through the HTML parser, not the whole article around it
+        data = data[bounds[0]:bounds[1]]
+    soup = BeautifulSoup(data.decode(encoding, errors="replace"), "html.parser", parse_only=SoupStrainer("table", {"class": "wikitable sortable"}))
+    # Find and extract the table containing the country data
+    table = soup.find("table")
+    if table is None:
+        raise ValueError("No 'wikitable sortable' table in the page")
+
+    country_data = {}
+    for row in table.find_all("tr")[1:]:      #<tr> is table row, <td> is table cell and <th> is table header
+        columns = row.find_all("td")
+        country = columns[1].text.strip()
+        score = columns[2].text.strip()
+        country_data[country] = score
+    return country_data
+
+
+def parse_country_risks(fragility_html, natural_disaster_html):
+    fragility = {country: float(score) for country, score in parse_wikitable(fragility_html).items()}
+    natural_disaster = {country: float(score.replace('%', '')) for country, score in parse_wikitable(natural_disaster_html).items()}
+    return fragility, natural_disaster
+
+
+def make_session(retries=REQUEST_RETRIES, pool_size=4):
+    # Pooled keep-alive session that retries connection errors and transient server errors with backoff
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Same as the original fetch, which had to get through TLS-intercepting corporate proxies
+    session.verify = False
+    return session
+
+
+def _get_session():
+    global _session
+    with _snapshot_lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+
+def fetch_table(url, validators=None, session=None, timeout=REQUEST_TIMEOUT):
+    # (table rows or None if the page is unchanged since the validators were issued, new validators)
+    session = session or _get_session()
+    validators = validators or {}
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    with session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304:
+            return None, validators
+        response.raise_for_status()
+        # Pages without a declared charset are still UTF-8 on Wikipedia
+        encoding = response.encoding if "charset" in response.headers.get("Content-Type", "") else "utf-8"
+        data = bytearray()
+        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+            data += chunk
+            if _table_bounds(data) is not None:
+                # Everything after the table is navigation and references
+                break
+        new_validators = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+    return parse_wikitable(bytes(data), encoding), new_validators
+
+
+def fetch_country_risks(fragility_url=FRAGILITY_URL, natural_disaster_url=NATURAL_DISASTER_URL, previous=None, session=None, timeout=REQUEST_TIMEOUT):
+    # Both tables fetched concurrently; with a previous snapshot, unchanged pages are not downloaded again and keep
+    # their previous values. Returns (fragility, natural_disaster, validators, changed)
+    previous = previous or {}
+    validators = previous.get("validators", {})
+    session = session or _get_session()
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="country-risk-fetch") as executor:
+        fragility_future = executor.submit(fetch_table, fragility_url, validators.get("fragility"), session, timeout)
+        natural_disaster_future = executor.submit(fetch_table, natural_disaster_url, validators.get("natural_disaster"), session, timeout)
+        fragility_rows, fragility_validators = fragility_future.result()
+        natural_disaster_rows, natural_disaster_validators = natural_disaster_future.result()
+
+    fragility, natural_disaster = previous.get("fragility"), previous.get("natural_disaster")
+    if fragility_rows is not None:
+        fragility = {country: float(score) for country, score in fragility_rows.items()}
+    if natural_disaster_rows is not None:
+        natural_disaster = {country: float(score.replace('%', '')) for country, score in natural_disaster_rows.items()}
+    validators = {"fragility": fragility_validators, "natural_disaster": natural_disaster_validators}
+    return fragility, natural_disaster, validators, fragility_rows is not None or natural_disaster_rows is not None
+
+
+def refresh_snapshot(fragility_url=FRAGILITY_URL, natural_disaster_url=NATURAL_DISASTER_URL, session=None):
+    # Fetch both tables and store them as the next snapshot version; if neither page changed, only the fetch date
+    # moves forward
+    global _snapshot
+    previous = get_snapshot()
+    # Validators only apply to the pages they were issued for
+    conditional = previous if previous.get("urls") == {"fragility": fragility_url, "natural_disaster": natural_disaster_url} else None
+    fragility, natural_disaster, validators, changed = fetch_country_risks(fragility_url, natural_disaster_url, conditional, session)
+    snapshot = {
+        "version": previous.get("version", 0) + (1 if changed else 0),
+        "source": "wikipedia",
+        "fetched_at": datetime.now(timezone.utc).isoformat(),
+        "urls": {"fragility": fragility_url, "natural_disaster": natural_disaster_url},
+        "validators": validators,
+        "fragility": fragility,
+        "natural_disaster": natural_disaster,
+    }
+    save_snapshot(snapshot)
+    with _snapshot_lock:
+        _snapshot = snapshot
+    return snapshot
+
+
+def _refresh_quietly():
+    global _last_refresh_error
+    try:
+        refresh_snapshot()
+    except Exception as e:
+        # Offline or Wikipedia changed its layout: keep serving the snapshot we already have
+        _last_refresh_error = f"{type(e).__name__}: {e}"
+    else:
+        _last_refresh_error = None
+
+
+def refresh_in_background(force=False):
+    # Starts a refresh thread unless one is running or the last attempt was too recent; never blocks the caller
+    global _refresh_thread, _last_refresh_attempt
+    now = datetime.now(timezone.utc)
+    with _snapshot_lock:
+        if _refresh_thread is not None and _refresh_thread.is_alive():
+            return _refresh_thread
+        if not force and _last_refresh_attempt is not None and now - _last_refresh_attempt < REFRESH_RETRY_INTERVAL:
+            return None
+        _last_refresh_attempt = now
+        _refresh_thread = threading.Thread(target=_refresh_quietly, name="country-risk-refresh", daemon=True)
+        _refresh_thread.start()
+        return _refresh_thread
+
+
+def refresh_status():
+    # (refresh running, error of the last finished attempt or None)
+    return _refresh_thread is not None and _refresh_thread.is_alive(), _last_refresh_error
+
+
+def get_snapshot(auto_refresh=False):
+    # Loaded from disk once per process; never touches the network itself
+    global _snapshot
+    with _snapshot_lock:
+        instrumentation.cache_access("country_risk_snapshot", _snapshot is not None)
+        if _snapshot is None:
+            _snapshot = load_snapshot()
+        snapshot = _snapshot
+    instrumentation.size("country_risk_countries", len(snapshot["fragility"]))
+    if auto_refresh and is_stale(snapshot):
+        refresh_in_background()
+    return snapshot
+
+
+def lookup_country(country, snapshot=None):
+    # Raises IndexError when the country is missing, like the old DataFrame lookup did
+    snapshot = snapshot or get_snapshot()
+    try:
+        return snapshot["fragility"][country], snapshot["natural_disaster"][country]
+    except KeyError:
+        raise IndexError(country)
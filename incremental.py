@@ -0,0 +1,306 @@
+import argparse
+import os
+import pickle
+import sys
+
+import numpy as np
+import pandas as pd
+
+import scaler_model
+import scoring
+import targets
+from score_index import ScoreIndex
+from storage import CACHE_DIR
+
+
+# ======================================== INCREMENTAL PORTFOLIO ======================================================= #
+#
+# Keeps a scored portfolio in memory (or on disk between runs) and applies change sets of inserted, updated and
+# deleted suppliers to it. Only the changed rows are scaled, scored and solved for targets. The running scaling
+# statistics are updated exactly with the pairwise Welford update and its inverse, but the scaler the scores are
+# computed with is only replaced, and the whole portfolio rescored, once those statistics drift from it by more
+# than the tolerance (in standard deviations of the current scaler). The rank index is updated in place the same
+# way. Every change set returns the suppliers whose strength band changed, which is what the weekly review needs.
+#
+#     python incremental.py init portfolio.xlsx --key "Supplier ID"
+#     python incremental.py apply portfolio_next_week.xlsx -o band_changes.csv
+
+STATE_DIR = os.path.join(CACHE_DIR, "incremental")
+# Largest drift of any feature's mean or standard deviation, in standard deviations of the scaler in use, that is
+# tolerated before the portfolio is rescaled and rescored as a whole
+DEFAULT_TOLERANCE = 0.01
+
+RISK_COLUMNS = ["Fragility Index", "Natural Disaster Risk"]
+# Columns score_frame derives from the inputs; everything else in the frame is input
+DERIVED_COLUMNS = scoring.SCALED_FEATURES + ["SCR_score", "SCR_Strength", "SCR_Strength_Label"] + scoring.REQUIRED_SCALED + scoring.REQUIRED + ["BCP Risk Required with negative"]
+
+
+class ChangeSet:
+    # inserts / updates: DataFrames indexed by supplier key (updates may carry only the changed columns);
+    # deletes: supplier keys
+    def __init__(self, inserts=None, updates=None, deletes=()):
+        self.inserts = inserts if inserts is not None else pd.DataFrame()
+        self.updates = updates if updates is not None else pd.DataFrame()
+        self.deletes = pd.Index(deletes)
+
+    def __len__(self):
+        return len(self.inserts) + len(self.updates) + len(self.deletes)
+
+    def __repr__(self):
+        return f"ChangeSet({len(self.inserts)} inserts, {len(self.updates)} updates, {len(self.deletes)} deletes)"
+
+
+def _normalise_inputs(df):
+    # BCP labels as 0 / 1 / 2, like score_frame stores them, so old and new rows compare equal
+    df = df.copy()
+    if "BCP_risk" in df.columns and not pd.api.types.is_numeric_dtype(df["BCP_risk"]):
+        df["BCP_risk"] = scoring.bcp_codes(df["BCP_risk"], df.index).astype(float)
+    return df
+
+
+def _attach_risks(df, recompute):
+    # Country risk columns from the snapshot for rows that name a country but do not carry (current) risk values
+    country_column = next((c for c in scoring.COUNTRY_COLUMNS if c in df.columns), None)
+    if country_column is None or not recompute.any():
+        return df
+    looked_up = scoring.attach_country_risks(df.loc[recompute].drop(columns=RISK_COLUMNS, errors="ignore"))
+    df = df.copy()
+    for column in RISK_COLUMNS:
+        if column not in df.columns:
+            df[column] = np.nan
+        df.loc[recompute, column] = looked_up[column]
+    return df
+
+
+def change_set_from_frames(old, new, columns=None):
+    # Inserts, updates and deletes that turn the inputs of `old` into `new`, both indexed by supplier key
+    if not new.index.is_unique:
+        raise ValueError("Supplier keys must be unique")
+    new = _normalise_inputs(new)
+    columns = columns or [c for c in new.columns if c in old.columns and c not in DERIVED_COLUMNS]
+    inserts = new.loc[new.index.difference(old.index, sort=False)]
+    deletes = old.index.difference(new.index, sort=False)
+    common = new.index.intersection(old.index, sort=False)
+    changed = np.zeros(len(common), dtype=bool)
+    for column in columns:
+        a, b = old.loc[common, column], new.loc[common, column]
+        if pd.api.types.is_numeric_dtype(a) and pd.api.types.is_numeric_dtype(b):
+            # Ignores the last-digit noise of a CSV / Excel round trip
+            changed |= ~np.isclose(a.to_numpy(dtype=float), b.to_numpy(dtype=float), rtol=1e-12, atol=0, equal_nan=True)
+        else:
+            changed |= ((a != b) & ~(a.isna() & b.isna())).to_numpy()
+    return ChangeSet(inserts, new.loc[common[changed]], deletes)
+
+
+class IncrementalPortfolio:
+    def __init__(self, df, weights=scoring.WEIGHTS, thresholds=scoring.THRESHOLDS, tolerance=DEFAULT_TOLERANCE, scaler=None):
+        # df is indexed by supplier key; scaler defaults to the statistics of df itself
+        if not df.index.is_unique:
+            raise ValueError("Supplier keys must be unique")
+        self.weights = np.asarray(weights, dtype=float)
+        self.thresholds = thresholds
+        self.tolerance = tolerance
+        df = scoring.attach_country_risks(df)
+        self.stats = scaler_model.fit_model(scoring.feature_matrix(df), source="incremental")
+        self.scaler = scaler or scaler_model.model_scaler(self.stats)
+        self.frame = self._score(df)
+        self.index = self._build_index()
+        self.rescales = 0
+
+    def _score(self, df):
+        return scoring.score_frame(df, scaler=self.scaler, weights=self.weights, thresholds=self.thresholds)
+
+    def _countries(self, frame):
+        column = next((c for c in scoring.COUNTRY_COLUMNS if c in frame.columns), None)
+        return frame[column].to_numpy() if column else None
+
+    def _build_index(self):
+        return ScoreIndex(self.frame["SCR_score"].to_numpy(), self.frame["SCR_Strength"].to_numpy(), self._countries(self.frame))
+
+    def drift(self):
+        # Largest shift of any feature's mean or standard deviation away from the scaler in use, in its std units
+        mean, scale = self.scaler
+        new_mean, new_scale = scaler_model.model_scaler(self.stats)
+        return float(max(np.max(np.abs(new_mean - mean) / scale), np.max(np.abs(new_scale - scale) / scale)))
+
+    def percentile(self, scores, band=None, country=None):
+        return self.index.percentile(scores, band, country)
+
+    def _updated_rows(self, updates):
+        # Old rows with the updated columns overwritten; country risks are looked up again when the country changed
+        # but the risk values did not come with it
+        old = self.frame.loc[updates.index]
+        rows = old[[c for c in self.frame.columns if c not in DERIVED_COLUMNS]].copy()
+        for column in updates.columns:
+            rows[column] = updates[column]
+        country_changed = np.zeros(len(rows), dtype=bool)
+        for column in scoring.COUNTRY_COLUMNS:
+            if column in updates.columns and column in old.columns:
+                country_changed |= updates[column].ne(old[column]).to_numpy()
+        risks_kept = np.ones(len(rows), dtype=bool)
+        for column in RISK_COLUMNS:
+            if column in updates.columns:
+                risks_kept &= updates[column].eq(old[column]).to_numpy() | updates[column].isna().to_numpy()
+        return _attach_risks(rows, country_changed & risks_kept)
+
+    def apply(self, changes):
+        # Apply a ChangeSet and return the band changes it caused, one row per affected supplier
+        inserts, updates, deletes = _normalise_inputs(changes.inserts), _normalise_inputs(changes.updates), changes.deletes
+        # Keys of another dtype would make every lookup cast, and re-hash, the whole portfolio index
+        key_dtype = self.frame.index.dtype
+        inserts, updates = (df.set_axis(df.index.astype(key_dtype)) for df in (inserts, updates))
+        deletes = deletes.astype(key_dtype)
+        positions = {}
+        for name, keys, should_exist in (("Inserted", inserts.index, False), ("Updated", updates.index, True), ("Deleted", deletes, True)):
+            # get_indexer reuses the hash table of the portfolio index; isin on string keys goes row by row in Python
+            positions[name] = self.frame.index.get_indexer(keys)
+            present = positions[name] >= 0
+            wrong = keys[~present] if should_exist else keys[present]
+            if len(wrong):
+                raise KeyError(f"{name} suppliers {'not' if should_exist else 'already'} in the portfolio: {list(wrong[:5])}")
+        if len(inserts):
+            inserts = _attach_risks(inserts, ~inserts.reindex(columns=RISK_COLUMNS).notna().all(axis=1).to_numpy())
+        updated = self._updated_rows(updates) if len(updates) else updates
+
+        removed_at = np.concatenate([positions["Deleted"], positions["Updated"]])
+        removed = self.frame.iloc[removed_at]
+        added = pd.concat([updated, inserts]) if len(inserts) else updated
+        keep = np.ones(len(self.frame), dtype=bool)
+        keep[positions["Deleted"]] = False
+
+        # Running statistics follow every change exactly
+        self.stats = scaler_model.remove_rows(self.stats, scoring.feature_matrix(removed), source="incremental")
+        if len(added):
+            self.stats = scaler_model.update_model(self.stats, scoring.feature_matrix(added), source="incremental")
+
+        if self.drift() > self.tolerance:
+            # The statistics moved enough to matter: adopt them and rescore everything in one vectorized pass
+            before = self.frame[["SCR_score", "SCR_Strength"]]
+            keep[positions["Updated"]] = False
+            frame = self.frame.iloc[keep]
+            frame = pd.concat([frame[[c for c in frame.columns if c not in DERIVED_COLUMNS]], added])
+            # Start again from exact statistics so downdate rounding does not accumulate
+            self.stats = scaler_model.fit_model(scoring.feature_matrix(frame), source="incremental")
+            self.scaler = scaler_model.model_scaler(self.stats)
+            self.frame = self._score(frame)
+            self.index = self._build_index()
+            self.rescales += 1
+            return self._band_diff(before, self.frame[["SCR_score", "SCR_Strength"]], inserts.index, deletes, True)
+
+        # Otherwise only the changed rows are scored, and written back by position
+        scored = self._score(added) if len(added) else self.frame.iloc[:0]
+        self.index.remove(removed["SCR_score"].to_numpy(), removed["SCR_Strength"].to_numpy(), self._countries(removed))
+        if len(scored):
+            self.index.add(scored["SCR_score"].to_numpy(), scored["SCR_Strength"].to_numpy(), self._countries(scored))
+        frame = self.frame
+        if len(updated):
+            for column in scored.columns:
+                if column in frame.columns:
+                    frame.iloc[positions["Updated"], frame.columns.get_loc(column)] = scored[column].to_numpy()[:len(updated)]
+        if len(deletes):
+            frame = frame.iloc[keep]
+        if len(inserts):
+            frame = pd.concat([frame, scored.iloc[len(updated):]])
+        self.frame = frame
+        return self._band_diff(removed[["SCR_score", "SCR_Strength"]], scored[["SCR_score", "SCR_Strength"]], inserts.index, deletes, False)
+
+    def _band_diff(self, before, after, inserted, deleted, rescaled):
+        # before / after: scores of every supplier whose band may have changed, before and after the change set
+        kept = after.drop(index=inserted)
+        previous = before["SCR_Strength"].reindex(kept.index).to_numpy()
+        current = kept["SCR_Strength"].to_numpy()
+        moved = previous != current
+        keys = kept.index[moved].append(inserted).append(deleted)
+
+        diff = pd.DataFrame({
+            "Previous SCR_score": before["SCR_score"].reindex(keys),
+            "SCR_score": after["SCR_score"].reindex(keys),
+        })
+        diff["Previous Strength"] = before["SCR_Strength"].reindex(keys).map(scoring.STRENGTH_LABELS)
+        diff["Strength"] = after["SCR_Strength"].reindex(keys).map(scoring.STRENGTH_LABELS)
+        diff["Change"] = np.concatenate([
+            np.where(current[moved] > previous[moved], "moved up", "moved down"),
+            np.repeat("inserted", len(inserted)),
+            np.repeat("deleted", len(deleted)),
+        ])
+        diff["Rescaled"] = rescaled
+        return diff
+
+    def targets(self, keys):
+        # Target KPIs for some suppliers, straight from the stored scaled values
+        rows = self.frame.loc[keys]
+        mean, scale = self.scaler
+        return targets.solve_targets(rows[scoring.SCALED_FEATURES].to_numpy(), rows["SCR_score"].to_numpy(), rows["SCR_Strength"].to_numpy(), mean, scale, self.weights, self.thresholds)
+
+
+def _state_path(name):
+    return os.path.join(STATE_DIR, f"{name}.pkl")
+
+
+def save_state(portfolio, name="portfolio"):
+    # Only the attributes are pickled, so state saved by the CLI (where the class lives in __main__) loads anywhere
+    os.makedirs(STATE_DIR, exist_ok=True)
+    tmp_path = _state_path(name) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(vars(portfolio), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, _state_path(name))
+
+
+def load_state(name="portfolio"):
+    with open(_state_path(name), "rb") as f:
+        state = pickle.load(f)
+    portfolio = IncrementalPortfolio.__new__(IncrementalPortfolio)
+    portfolio.__dict__.update(state)
+    return portfolio
+
+
+def _read_keyed(path, key):
+    df = scoring.read_table(path)
+    if key not in df.columns:
+        raise KeyError(f"{path} has no {key!r} column to identify suppliers by")
+    return df.set_index(key)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep a scored portfolio up to date incrementally and report band changes.")
+    parser.add_argument("--name", default="portfolio", help="Name of the stored portfolio state")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    init_parser = subparsers.add_parser("init", help="Score a portfolio from scratch and store it")
+    init_parser.add_argument("portfolio", nargs="?", default=scoring.PORTFOLIO_PATH)
+    # Suppliers must be matched by a key: matched by row position, one deleted row would shift every row after it
+    init_parser.add_argument("--key", required=True, help="Column identifying a supplier")
+    init_parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    init_parser.add_argument("--profile", help="Score with the weights of this AHP weight profile")
+    apply_parser = subparsers.add_parser("apply", help="Apply the differences to a new version of the portfolio")
+    apply_parser.add_argument("portfolio", help="New version of the portfolio file")
+    apply_parser.add_argument("--key", help="Column identifying a supplier (default: the key the portfolio was stored with)")
+    apply_parser.add_argument("-o", "--output", help="Where to write the band changes (defaults to stdout as CSV)")
+    args = parser.parse_args(argv)
+
+    if args.command == "init":
+        weights = scoring.WEIGHTS
+        if args.profile:
+            import ahp
+
+            weights = ahp.get_weights(args.profile)
+        portfolio = IncrementalPortfolio(_read_keyed(args.portfolio, args.key), weights, tolerance=args.tolerance)
+        save_state(portfolio, args.name)
+        print(f"Stored {len(portfolio.frame)} scored suppliers as '{args.name}'", file=sys.stderr)
+        return
+
+    portfolio = load_state(args.name)
+    key = args.key or portfolio.frame.index.name
+    if key is None:
+        parser.error(f"'{args.name}' was stored without a supplier key; pass --key or run init again with --key")
+    changes = change_set_from_frames(portfolio.frame, _read_keyed(args.portfolio, key))
+    diff = portfolio.apply(changes)
+    save_state(portfolio, args.name)
+    print(f"Applied {changes}; drift {portfolio.drift():.4f}, {len(diff)} suppliers changed band", file=sys.stderr)
+    if args.output:
+        scoring.write_table(diff.reset_index(), args.output)
+    else:
+        diff.reset_index().to_csv(sys.stdout, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import argparse
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+from storage import CACHE_DIR
+
+
+# ======================================== INSTRUMENTATION ======================================================= #
+#
+# Named timing spans, cache hit / miss counters and data sizes for each simulation run. A run is opened around the
+# work with `with run("simulate"):`; anything inside can call span(), count() or size() and it lands on that run.
+# Outside a run these calls do nothing, so library code can be instrumented unconditionally.
+#
+# Finished runs are kept in memory for the app's diagnostics panel, logged as one structured line on the
+# "scr.metrics" logger and appended to a JSON Lines metrics file, from which latency percentiles can be aggregated
+# across users with `python instrumentation.py summary`.
+
+METRICS_PATH = os.environ.get("SCR_METRICS_PATH", os.path.join(CACHE_DIR, "metrics", "runs.jsonl"))
+RECENT_RUNS = 50
+
+logger = logging.getLogger("scr.metrics")
+
+_current_run = contextvars.ContextVar("scr_current_run", default=None)
+_recent_runs = deque(maxlen=RECENT_RUNS)
+_write_lock = threading.Lock()
+
+
+class Run:
+    def __init__(self, name, attributes=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.attributes = dict(attributes or {})
+        self.spans = {}
+        self.counters = {}
+        self.sizes = {}
+        self.total_ms = None
+        self.error = None
+
+    def to_dict(self):
+        return {
+            "run_id": self.id,
+            "run": self.name,
+            "started_at": self.started_at,
+            "total_ms": self.total_ms,
+            "spans_ms": self.spans,
+            "counters": self.counters,
+            "sizes": self.sizes,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def current_run():
+    return _current_run.get()
+
+
+@contextlib.contextmanager
+def run(name, **attributes):
+    current = Run(name, attributes)
+    token = _current_run.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.total_ms = (time.perf_counter() - start) * 1000
+        _current_run.reset(token)
+        _finish(current)
+
+
+@contextlib.contextmanager
+def span(name):
+    # Time a stage of the current run; spans with the same name add up
+    current = _current_run.get()
+    if current is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.spans[name] = current.spans.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def count(name, n=1):
+    current = _current_run.get()
+    if current is not None:
+        current.counters[name] = current.counters.get(name, 0) + n
+
+
+def cache_access(cache, hit):
+    count(f"{cache}.{'hit' if hit else 'miss'}")
+
+
+def size(name, value):
+    current = _current_run.get()
+    if current is not None:
+        current.sizes[name] = value
+
+
+def recent_runs():
+    return list(_recent_runs)
+
+
+def _finish(current):
+    record = current.to_dict()
+    _recent_runs.append(record)
+    logger.info(json.dumps(record))
+    try:
+        with _write_lock:
+            os.makedirs(os.path.dirname(METRICS_PATH), exist_ok=True)
+            with open(METRICS_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+    except OSError:
+        # Metrics must never break a simulation
+        logger.warning("Could not write metrics to %s", METRICS_PATH)
+
+
+def read_runs(path=METRICS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(runs, percentiles=(50, 90, 99)):
+    # Latency percentiles per run type and span, and cache hit rates, over many runs
+    import numpy as np
+
+    summary = {}
+    for name in sorted({r["run"] for r in runs}):
+        selected = [r for r in runs if r["run"] == name]
+        timings = {"total": [r["total_ms"] for r in selected]}
+        for r in selected:
+            for span_name, ms in r["spans_ms"].items():
+                timings.setdefault(span_name, []).append(ms)
+        counters = {}
+        for r in selected:
+            for counter, value in r["counters"].items():
+                counters[counter] = counters.get(counter, 0) + value
+        hit_rates = {}
+        for cache in sorted({c.rsplit(".", 1)[0] for c in counters if c.endswith((".hit", ".miss"))}):
+            hits, misses = counters.get(f"{cache}.hit", 0), counters.get(f"{cache}.miss", 0)
+            hit_rates[cache] = hits / (hits + misses)
+        summary[name] = {
+            "runs": len(selected),
+            "latency_ms": {k: {f"p{p}": float(np.percentile(v, p)) for p in percentiles} for k, v in timings.items()},
+            "cache_hit_rate": hit_rates,
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate simulation metrics written by the app.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    summary_parser = subparsers.add_parser("summary", help="Latency percentiles and cache hit rates")
+    summary_parser.add_argument("paths", nargs="*", default=[METRICS_PATH], help="Metrics files, e.g. collected from several servers")
+    args = parser.parse_args(argv)
+
+    runs = [r for path in args.paths for r in read_runs(path)]
+    print(json.dumps(summarize(runs), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import scoring
+import targets
+
+
+# ======================================== MONTE CARLO UNCERTAINTY ======================================================= #
+#
+# Lead times vary shipment to shipment and country risk indices get revised, so instead of a single point the inputs
+# can be given as distributions. Each supplier is scored on tens of thousands of vectorized samples, reporting the
+# probability of each strength band and confidence intervals on the score and the target KPIs.
+#
+# A KPI is either a plain number or a dict such as
+#     {"dist": "normal", "mean": 30, "std": 5}
+#     {"dist": "triangular", "low": 20, "mode": 30, "high": 60}
+#     {"dist": "uniform", "low": 20, "high": 40}
+#     {"dist": "categorical", "p": {"LOW": 0.7, "MEDIUM": 0.3}}     (BCP risk only)
+#
+# Supplier i of a run with seed s always draws from the generator seeded with (s, i), so results are reproducible
+# and do not depend on how the portfolio is split across processes.
+
+DEFAULT_SAMPLES = 20000
+DEFAULT_CONFIDENCE = 0.95
+
+
+def _sample_feature(spec, n, rng):
+    if not isinstance(spec, dict):
+        value = scoring.BCP_MAPPING.get(spec, spec)
+        return np.full(n, float(value))
+    dist = spec["dist"]
+    if dist == "normal":
+        return rng.normal(spec["mean"], spec["std"], n)
+    if dist == "triangular":
+        return rng.triangular(spec["low"], spec["mode"], spec["high"], n)
+    if dist == "uniform":
+        return rng.uniform(spec["low"], spec["high"], n)
+    if dist == "categorical":
+        levels = np.array([scoring.BCP_MAPPING.get(k, k) for k in spec["p"]], dtype=float)
+        p = np.array(list(spec["p"].values()), dtype=float)
+        return rng.choice(levels, size=n, p=p / p.sum())
+    raise ValueError(f"Unknown distribution {dist!r}")
+
+
+def sample_inputs(spec, n, rng):
+    # (n, 5) matrix of raw KPI samples in scoring.FEATURES order; physical KPIs cannot go below zero
+    X = np.column_stack([_sample_feature(spec[name], n, rng) for name in scoring.FEATURES])
+    np.maximum(X[:, :4], 0, out=X[:, :4])
+    X[:, 4] = np.clip(np.rint(X[:, 4]), 0, 2)
+    return X
+
+
+def _interval(values, confidence):
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return (np.nan, np.nan)
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(values, [tail, 100 - tail])
+    return (float(low), float(high))
+
+
+def simulate_supplier(spec, scaler, n_samples=DEFAULT_SAMPLES, seed=0, index=0, weights=scoring.WEIGHTS, thresholds=scoring.THRESHOLDS, confidence=DEFAULT_CONFIDENCE):
+    rng = np.random.default_rng([seed, index])
+    mean, scale = scaler
+    X = sample_inputs(spec, n_samples, rng)
+    Z = scoring.transform(X, mean, scale)
+    scores = scoring.score(Z, weights)
+    strengths = scoring.strength(scores, thresholds)
+    counts = np.bincount(strengths, minlength=3)
+
+    result = {
+        "samples": n_samples,
+        "P(LOW)": counts[0] / n_samples,
+        "P(MEDIUM)": counts[1] / n_samples,
+        "P(HIGH)": counts[2] / n_samples,
+        "SCR_score mean": float(scores.mean()),
+    }
+    result["SCR_score low"], result["SCR_score high"] = _interval(scores, confidence)
+
+    result["Most likely band"] = scoring.STRENGTH_LABELS[int(counts.argmax())]
+    # Target KPIs for each sample to move up from its own band; samples already HIGH have none and are left out of
+    # the intervals, which are therefore defined whenever P(HIGH) < 1
+    _, required, _ = targets.solve_targets(Z, scores, strengths, mean, scale, weights, thresholds)
+    for j, name in enumerate(scoring.REQUIRED):
+        result[f"{name} low"], result[f"{name} high"] = _interval(required[:, j], confidence)
+    return result
+
+
+def _simulate_chunk(args):
+    specs, start, scaler, n_samples, seed, weights, thresholds, confidence = args
+    return [simulate_supplier(spec, scaler, n_samples, seed, start + i, weights, thresholds, confidence) for i, spec in enumerate(specs)]
+
+
+def simulate_portfolio(specs, scaler, n_samples=DEFAULT_SAMPLES, seed=0, processes=None, chunk_size=64, weights=scoring.WEIGHTS, thresholds=scoring.THRESHOLDS, confidence=DEFAULT_CONFIDENCE):
+    # One result row per supplier spec, spread over a process pool in chunks
+    chunks = [(specs[i:i + chunk_size], i, scaler, n_samples, seed, weights, thresholds, confidence) for i in range(0, len(specs), chunk_size)]
+    if processes == 1 or len(chunks) <= 1:
+        rows = [row for chunk in chunks for row in _simulate_chunk(chunk)]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            rows = [row for chunk_rows in pool.map(_simulate_chunk, chunks) for row in chunk_rows]
+    return pd.DataFrame(rows)
+
+
+def specs_from_frame(df):
+    # One spec per row. Besides the point value column F, a "F Std" column makes F normal and "F Min" / "F Max"
+    # columns make it triangular around F.
+    columns = {}
+    for name in scoring.FEATURES:
+        point = df[name].map(lambda x: scoring.BCP_MAPPING.get(x, x)).to_numpy(dtype=float) if name == "BCP_risk" else df[name].to_numpy(dtype=float)
+        if f"{name} Std" in df.columns:
+            std = df[f"{name} Std"].to_numpy(dtype=float)
+            columns[name] = [{"dist": "normal", "mean": m, "std": s} for m, s in zip(point, std)]
+        elif f"{name} Min" in df.columns and f"{name} Max" in df.columns:
+            low, high = df[f"{name} Min"].to_numpy(dtype=float), df[f"{name} Max"].to_numpy(dtype=float)
+            columns[name] = [{"dist": "triangular", "low": lo, "mode": m, "high": hi} for lo, m, hi in zip(low, point, high)]
+        else:
+            columns[name] = list(point)
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo supply chain strength under uncertain KPIs.")
+    parser.add_argument("input", help="CSV, Parquet or Excel file, optionally with '<KPI> Std' or '<KPI> Min'/'<KPI> Max' columns")
+    parser.add_argument("-o", "--output", help="Where to write the results (defaults to stdout as CSV)")
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--confidence", type=float, default=DEFAULT_CONFIDENCE)
+    args = parser.parse_args(argv)
+
+    import scaler_model
+
+    df = scoring.attach_country_risks(scoring.read_table(args.input))
+    model = scaler_model.get_model()
+    results = simulate_portfolio(specs_from_frame(df), scaler_model.model_scaler(model), args.samples, args.seed, args.processes, confidence=args.confidence)
+    results = pd.concat([df.reset_index(drop=True), results], axis=1)
+
+    if args.output:
+        scoring.write_table(results, args.output)
+    else:
+        results.to_csv(sys.stdout, index=False)
+    print(f"Simulated {len(results)} suppliers x {args.samples} samples with scaling model {scaler_model.model_id(model)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
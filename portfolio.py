@@ -0,0 +1,140 @@
+import hashlib
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+import scaler_model
+import scoring
+from score_index import ScoreIndex
+from storage import CACHE_DIR, read_json, write_json_atomic
+
+
+# ======================================== PORTFOLIO ======================================================= #
+#
+# The reference portfolio, its scores against the current scaling model and the score index built over them, all
+# computed once per process and reused by every simulation.
+#
+# Parsing the workbook is by far the slowest way to get at a few numeric columns, so the first load converts it into
+# one .npy file per column under the cache directory and later loads memory-map those instead. Each workbook path
+# has its own conversion, keyed on the workbook's mtime and size with a content hash as the tie-breaker, and it is
+# rebuilt automatically when the workbook changes.
+
+PORTFOLIO_CACHE_DIR = os.path.join(CACHE_DIR, "portfolio")
+
+_lock = threading.Lock()
+_scored = {}
+
+
+def _file_hash(path):
+    # Read in chunks rather than with hashlib.file_digest, which needs Python 3.11
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_paths(path):
+    # One cache per workbook location: workbooks with the same file name in different directories must not share
+    # (and rebuild away) each other's conversion
+    path_hash = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:16]
+    name = f"{os.path.basename(path)}-{path_hash}"
+    return os.path.join(PORTFOLIO_CACHE_DIR, f"{name}.json"), os.path.join(PORTFOLIO_CACHE_DIR, name)
+
+
+def _build_column_cache(path, meta_path, columns_root, digest, stat):
+    df = pd.read_excel(path)
+    columns_dir = os.path.join(columns_root, digest[:16])
+    os.makedirs(columns_dir, exist_ok=True)
+    columns = []
+    for i, name in enumerate(df.columns):
+        values = df[name].to_numpy()
+        if not np.issubdtype(values.dtype, np.number) and values.dtype != np.bool_:
+            # Text columns are stored as fixed-width unicode so they can be memory-mapped without pickling
+            values = df[name].astype(str).to_numpy(dtype=str)
+        file_name = f"{i}.npy"
+        np.save(os.path.join(columns_dir, file_name), values, allow_pickle=False)
+        columns.append({"name": str(name), "file": file_name})
+
+    write_json_atomic(meta_path, {
+        "source": os.path.basename(path),
+        "sha256": digest,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "rows": len(df),
+        "directory": digest[:16],
+        "columns": columns,
+    })
+    # Conversions of older workbook versions are no longer needed
+    for entry in os.listdir(columns_root):
+        if entry != digest[:16]:
+            shutil.rmtree(os.path.join(columns_root, entry), ignore_errors=True)
+
+
+def _valid_cache(path, meta_path, stat):
+    if not os.path.exists(meta_path):
+        return None
+    meta = read_json(meta_path)
+    if meta["mtime_ns"] == stat.st_mtime_ns and meta["size"] == stat.st_size:
+        return meta
+    # Touched but possibly unchanged (e.g. copied or re-saved): compare contents before rebuilding
+    if meta["size"] == stat.st_size and meta["sha256"] == _file_hash(path):
+        meta["mtime_ns"] = stat.st_mtime_ns
+        write_json_atomic(meta_path, meta)
+        return meta
+    return None
+
+
+def load_portfolio_columns(path=scoring.PORTFOLIO_PATH):
+    # {column name: memory-mapped array}, converting the workbook first if it is new or has changed
+    meta_path, columns_root = _cache_paths(path)
+    stat = os.stat(path)
+    meta = _valid_cache(path, meta_path, stat)
+    instrumentation.cache_access("portfolio_file", meta is not None)
+    if meta is None:
+        _build_column_cache(path, meta_path, columns_root, _file_hash(path), stat)
+        meta = read_json(meta_path)
+    columns_dir = os.path.join(columns_root, meta["directory"])
+    return {column["name"]: np.load(os.path.join(columns_dir, column["file"]), mmap_mode="r") for column in meta["columns"]}
+
+
+def load_portfolio(path=scoring.PORTFOLIO_PATH):
+    return pd.DataFrame(load_portfolio_columns(path), copy=False)
+
+
+def _country_column(df):
+    return next((c for c in scoring.COUNTRY_COLUMNS if c in df.columns), None)
+
+
+def get_scored_portfolio(model=None, weights=scoring.WEIGHTS):
+    # Portfolio scored against the given (default: current) scaling model, cached per model version and weights
+    model = model or scaler_model.get_model()
+    key = (scaler_model.model_id(model), tuple(np.round(weights, 12)))
+    with _lock:
+        instrumentation.cache_access("scored_portfolio", key in _scored)
+        if key not in _scored:
+            df = load_portfolio()
+            result = scoring.score_frame(df, scaler=scaler_model.model_scaler(model), weights=np.asarray(weights))
+            country_column = _country_column(result)
+            countries = result[country_column].to_numpy() if country_column else None
+            index = ScoreIndex(result["SCR_score"].to_numpy(), result["SCR_Strength"].to_numpy(), countries)
+            _scored[key] = (result, index)
+        instrumentation.size("portfolio_rows", len(_scored[key][0]))
+        return _scored[key]
+
+
+def get_score_index(model=None, weights=scoring.WEIGHTS):
+    return get_scored_portfolio(model, weights)[1]
+
+
+def rescore(weights, model=None, thresholds=scoring.THRESHOLDS):
+    # Scores and bands of the whole portfolio under other weights, reusing the already scaled KPIs: one
+    # matrix-vector product, so a weight profile change costs milliseconds even on large portfolios
+    result, _ = get_scored_portfolio(model)
+    Z = result[scoring.SCALED_FEATURES].to_numpy()
+    scores = scoring.score(Z, np.asarray(weights))
+    return scores, scoring.strength(scores, thresholds)
@@ -0,0 +1,199 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+import instrumentation
+import scoring
+from storage import CACHE_DIR, DATA_DIR, read_json, write_json_atomic
+
+
+# ======================================== REFERENCE SCALING MODEL ======================================================= #
+#
+# Per-feature mean and standard deviation of the five KPIs over the reference portfolio, fitted once and reused for
+# every score, so a simulated supplier no longer shifts the statistics it is scored against. The model keeps the
+# running count, mean and sum of squared deviations (M2), so new portfolio rows can be folded in with the parallel
+# form of Welford's algorithm instead of a full refit. Every update gets a new version and is archived, so a score
+# can always be reproduced from the model version it was computed with.
+
+BUNDLED_MODEL_PATH = os.path.join(DATA_DIR, "scaler_model.json")
+MODEL_PATH = os.path.join(CACHE_DIR, "scaler_model.json")
+ARCHIVE_DIR = os.path.join(CACHE_DIR, "scaler_models")
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def _fingerprint(count, mean, m2):
+    payload = json.dumps([count, list(mean), list(m2)]).encode()
+    return hashlib.sha256(payload).hexdigest()[:12]
+
+
+def _make_model(count, mean, m2, version, source):
+    mean = [float(x) for x in mean]
+    m2 = [float(x) for x in m2]
+    return {
+        "version": version,
+        "fingerprint": _fingerprint(count, mean, m2),
+        "features": scoring.FEATURES,
+        "count": int(count),
+        "mean": mean,
+        "m2": m2,
+        "source": source,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def _batch_moments(X):
+    # Count, mean and M2 of one batch, two-pass for numerical stability
+    mean = X.mean(axis=0)
+    m2 = ((X - mean) ** 2).sum(axis=0)
+    return len(X), mean, m2
+
+
+def fit_model(X, source=None, version=1):
+    count, mean, m2 = _batch_moments(np.asarray(X, dtype=float))
+    return _make_model(count, mean, m2, version, source)
+
+
+def update_model(model, X_new, source=None, version=None):
+    # Fold new rows into the running statistics (Chan et al. pairwise update) without touching the old rows; the
+    # result is the next version unless a version is given
+    X_new = np.asarray(X_new, dtype=float)
+    if len(X_new) == 0:
+        return model
+    count_a, mean_a, m2_a = model["count"], np.array(model["mean"]), np.array(model["m2"])
+    count_b, mean_b, m2_b = _batch_moments(X_new)
+
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / count
+    m2 = m2_a + m2_b + delta ** 2 * count_a * count_b / count
+    return _make_model(count, mean, m2, model["version"] + 1 if version is None else version, source or model.get("source"))
+
+
+def remove_rows(model, X_old, source=None):
+    # Inverse of update_model: take rows back out of the running statistics, e.g. deleted or edited suppliers
+    X_old = np.asarray(X_old, dtype=float)
+    if len(X_old) == 0:
+        return model
+    count, mean, m2 = model["count"], np.array(model["mean"]), np.array(model["m2"])
+    count_b, mean_b, m2_b = _batch_moments(X_old)
+    count_a = count - count_b
+    if count_a <= 0:
+        raise ValueError("Cannot remove every row from a scaling model")
+    mean_a = (count * mean - count_b * mean_b) / count_a
+    delta = mean_b - mean_a
+    # Clipped at 0 against rounding when almost all the spread leaves with the removed rows
+    m2_a = np.maximum(m2 - m2_b - delta ** 2 * count_a * count_b / count, 0)
+    return _make_model(count_a, mean_a, m2_a, model["version"] + 1, source or model.get("source"))
+
+
+def model_scaler(model):
+    # (mean, scale) in the form the scoring engine expects; population std like StandardScaler
+    mean = np.array(model["mean"])
+    scale = np.sqrt(np.array(model["m2"]) / model["count"])
+    scale[scale == 0] = 1.0
+    return mean, scale
+
+
+def model_id(model):
+    return f"v{model['version']}-{model['fingerprint']}"
+
+
+def fit_reference_model(path=scoring.PORTFOLIO_PATH):
+    df = scoring.read_table(path)
+    return fit_model(scoring.feature_matrix(df), source=os.path.basename(path))
+
+
+def _latest_version():
+    # Highest version bundled or archived here, so a new model never reuses the number of one scores were computed with
+    versions = [read_json(BUNDLED_MODEL_PATH)["version"]] if os.path.exists(BUNDLED_MODEL_PATH) else []
+    if os.path.isdir(ARCHIVE_DIR):
+        versions += [int(name[1:-len(".json")]) for name in os.listdir(ARCHIVE_DIR) if name.startswith("v") and name.endswith(".json")]
+    return max(versions, default=0)
+
+
+def save_model(model):
+    write_json_atomic(MODEL_PATH, model)
+    write_json_atomic(os.path.join(ARCHIVE_DIR, f"v{model['version']}.json"), model)
+
+
+def load_model(version=None):
+    if version is not None:
+        archived = os.path.join(ARCHIVE_DIR, f"v{version}.json")
+        if os.path.exists(archived):
+            return read_json(archived)
+        bundled = read_json(BUNDLED_MODEL_PATH)
+        if bundled["version"] == version:
+            return bundled
+        raise FileNotFoundError(f"Scaling model version {version} is not available")
+    models = [read_json(path) for path in (MODEL_PATH, BUNDLED_MODEL_PATH) if os.path.exists(path)]
+    if models:
+        # The local model unless the app shipped a newer bundled one since it was saved
+        return max(models, key=lambda model: model["version"])
+    # Nothing on disk yet: fit on the reference portfolio once and keep it
+    model = fit_reference_model()
+    save_model(model)
+    return model
+
+
+def get_model():
+    # Loaded once per process
+    global _model
+    with _model_lock:
+        instrumentation.cache_access("scaling_model", _model is not None)
+        if _model is None:
+            _model = load_model()
+        return _model
+
+
+def apply_update(X_new, source=None):
+    # Update the current model with new portfolio rows, persist it and make it the process-wide model
+    global _model
+    with _model_lock:
+        current = _model if _model is not None else load_model()
+        # Numbered after every version known here, so it cannot reuse the number of a newer bundled model
+        model = update_model(current, X_new, source, version=_latest_version() + 1)
+        save_model(model)
+        _model = model
+    return model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the reference scaling model used to score suppliers.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    fit_parser = subparsers.add_parser("fit", help="Fit a fresh model on a reference portfolio")
+    fit_parser.add_argument("portfolio", nargs="?", default=scoring.PORTFOLIO_PATH)
+    fit_parser.add_argument("--bundled", action="store_true", help="Write the model that ships with the app instead of the local one")
+    update_parser = subparsers.add_parser("update", help="Fold new portfolio rows into the current model")
+    update_parser.add_argument("rows", help="CSV, Parquet or Excel file with the new rows")
+    subparsers.add_parser("show", help="Print the current model")
+    args = parser.parse_args(argv)
+
+    if args.command == "fit":
+        model = fit_reference_model(args.portfolio)
+        bundled = read_json(BUNDLED_MODEL_PATH) if args.bundled and os.path.exists(BUNDLED_MODEL_PATH) else None
+        if bundled is not None and bundled["fingerprint"] == model["fingerprint"]:
+            # Same statistics as the model that ships with the app: keep it and its version
+            model = bundled
+        else:
+            model = _make_model(model["count"], model["mean"], model["m2"], _latest_version() + 1, model["source"])
+            if args.bundled:
+                write_json_atomic(BUNDLED_MODEL_PATH, model)
+            else:
+                save_model(model)
+    elif args.command == "update":
+        df = scoring.attach_country_risks(scoring.read_table(args.rows))
+        model = apply_update(scoring.feature_matrix(df), source=os.path.basename(args.rows))
+    else:
+        model = load_model()
+    print(json.dumps(model, indent=2))
+
+
+if __name__ == "__main__":
+    main()
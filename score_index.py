@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+
+# ======================================== SCORE INDEX ======================================================= #
+#
+# Sorted arrays of portfolio SCR_scores, overall and per group (strength band, supplier country), so a supplier can be
+# ranked against the portfolio with a binary search instead of a pass over the whole frame. Newly added scores go to
+# a small sorted side buffer that is merged into the main array once it grows past sqrt(n), keeping inserts cheap
+# and lookups O(log n). Removing scores (deleted or rescored suppliers) deletes them in place with a binary search.
+
+
+def _remove_sorted(array, values):
+    # Remove one occurrence of each value in sorted `values` from sorted `array`; returns (array, values not found)
+    if len(array) == 0 or len(values) == 0:
+        return array, values
+    # The k-th copy of a repeated value takes the k-th matching slot
+    repeat = np.arange(len(values)) - np.searchsorted(values, values, side="left")
+    positions = np.searchsorted(array, values, side="left") + repeat
+    found = positions < np.searchsorted(array, values, side="right")
+    return np.delete(array, positions[found]), values[~found]
+
+
+class SortedScores:
+    def __init__(self, scores=()):
+        self._main = np.sort(np.asarray(scores, dtype=float))
+        self._pending = np.empty(0)
+
+    def __len__(self):
+        return len(self._main) + len(self._pending)
+
+    def add(self, scores):
+        scores = np.atleast_1d(np.asarray(scores, dtype=float))
+        self._pending = np.sort(np.concatenate([self._pending, scores]))
+        if len(self._pending) ** 2 > len(self._main):
+            self._main = np.sort(np.concatenate([self._main, self._pending]), kind="mergesort")
+            self._pending = np.empty(0)
+
+    def remove(self, scores):
+        scores = np.sort(np.atleast_1d(np.asarray(scores, dtype=float)))
+        self._pending, scores = _remove_sorted(self._pending, scores)
+        self._main, scores = _remove_sorted(self._main, scores)
+        if len(scores):
+            raise KeyError(f"Scores not in the index: {scores[:5].tolist()}")
+
+    def count_below(self, scores, side="left"):
+        # Number of indexed scores < (side="left") or <= (side="right") each query score
+        return np.searchsorted(self._main, scores, side=side) + np.searchsorted(self._pending, scores, side=side)
+
+    def _ranks(self, scores):
+        scores = np.asarray(scores, dtype=float)
+        if scores.ndim == 0 or scores.size < 1024:
+            return self.count_below(scores, "left"), self.count_below(scores, "right")
+        # Large batches: searching in sorted order is far more cache friendly, then scatter back
+        order = np.argsort(scores, kind="stable")
+        sorted_scores = scores[order]
+        below, at_or_below = np.empty(scores.shape, dtype=np.int64), np.empty(scores.shape, dtype=np.int64)
+        below[order] = self.count_below(sorted_scores, "left")
+        at_or_below[order] = self.count_below(sorted_scores, "right")
+        return below, at_or_below
+
+    def percentile(self, scores):
+        # Percentile rank in [0, 1], ties counted as half above and half below
+        n = len(self)
+        if n == 0:
+            return np.full(np.shape(scores), np.nan)
+        below, at_or_below = self._ranks(scores)
+        return (below + at_or_below) / (2 * n)
+
+
+class ScoreIndex:
+    def __init__(self, scores, bands=None, countries=None):
+        self.overall = SortedScores(scores)
+        self.by_band = self._group(scores, bands)
+        self.by_country = self._group(scores, countries)
+
+    @staticmethod
+    def _group(scores, keys):
+        if keys is None:
+            return {}
+        scores = np.asarray(scores, dtype=float)
+        # Hash-based factorize instead of sorting the keys, which is slow for country names. Rows without a key
+        # (code -1) only count towards the overall ranking, as in add() and remove().
+        codes, unique = pd.factorize(np.asarray(keys))
+        keyed = codes >= 0
+        scores, codes = scores[keyed], codes[keyed]
+        order = np.argsort(codes, kind="stable")
+        groups = np.split(scores[order], np.searchsorted(codes[order], np.arange(1, len(unique))))
+        return {key.item() if hasattr(key, "item") else key: SortedScores(group) for key, group in zip(unique, groups)}
+
+    @staticmethod
+    def _by_key(scores, keys):
+        codes, unique = pd.factorize(np.atleast_1d(np.asarray(keys)))
+        for code, key in enumerate(unique):
+            yield key.item() if hasattr(key, "item") else key, scores[codes == code]
+
+    def add(self, scores, bands=None, countries=None):
+        scores = np.atleast_1d(np.asarray(scores, dtype=float))
+        self.overall.add(scores)
+        for groups, keys in ((self.by_band, bands), (self.by_country, countries)):
+            if keys is not None:
+                for key, group in self._by_key(scores, keys):
+                    groups.setdefault(key, SortedScores()).add(group)
+
+    def remove(self, scores, bands=None, countries=None):
+        # bands / countries must be the ones the scores were added with
+        scores = np.atleast_1d(np.asarray(scores, dtype=float))
+        self.overall.remove(scores)
+        for groups, keys in ((self.by_band, bands), (self.by_country, countries)):
+            if keys is not None:
+                for key, group in self._by_key(scores, keys):
+                    groups[key].remove(group)
+
+    def percentile(self, scores, band=None, country=None):
+        # Rank against the whole portfolio, or only against one band / country when given
+        if band is not None:
+            sorted_scores = self.by_band.get(band, SortedScores())
+        elif country is not None:
+            sorted_scores = self.by_country.get(country, SortedScores())
+        else:
+            sorted_scores = self.overall
+        return sorted_scores.percentile(scores)
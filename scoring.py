@@ -0,0 +1,230 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import targets
+
+
+# ======================================== SCORING ENGINE ======================================================= #
+#
+# Streamlit-free version of the model behind run_script: standard scaling of the five KPIs, the weighted SCR_score,
+# the LOW / MEDIUM / HIGH bands and the KPI values needed to reach the next band. Everything works on whole NumPy
+# arrays, so scoring one supplier or a full portfolio is the same code path.
+
+FEATURES = ["Lead Time", "Distance (km)", "Fragility Index", "Natural Disaster Risk", "BCP_risk"]
+SCALED_FEATURES = ["Lead_Time_T", "Distance_T", "Fragility_Index_T", "Natural_Disaster_Risk_T", "BCP_Risk_T"]
+REQUIRED_SCALED = ["Lead Time Required Scaled", "Distance Required Scaled", "Fragility Required Scaled", "Natural Disaster Required Scaled", "BCP Risk Required Scaled"]
+REQUIRED = ["Lead Time Required", "Distance Required", "Fragility Required", "Natural Disaster Required", "BCP Risk Required"]
+
+# AHP weights, in FEATURES order
+WEIGHTS = np.array([0.205, 0.117, 0.042, 0.042, 0.595])
+# SCR_score <= -0.75 is LOW, -0.75 < SCR_score < -0.19 is MEDIUM, anything else is HIGH
+THRESHOLDS = (-0.75, -0.19)
+
+BCP_MAPPING = {"LOW": 0, "MEDIUM": 1, "HIGH": 2}
+BCP_LEVELS = sorted(BCP_MAPPING, key=BCP_MAPPING.get)
+STRENGTH_LABELS = {0: 'LOW', 1: 'MEDIUM', 2: 'HIGH'}
+
+COUNTRY_COLUMNS = ["Supplier Country", "Manufacturer Country"]
+PORTFOLIO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_data_for_scaler.xlsx")
+
+
+def _row_labels(positions, rows):
+    labels = positions if rows is None else np.asarray(rows)[positions]
+    return ", ".join(map(str, labels[:10])) + (f" and {len(labels) - 10} more" if len(labels) > 10 else "")
+
+
+def check_finite(X, rows=None):
+    # A missing KPI makes the score NaN, which falls through both band cut-offs into HIGH (and a NaN in the fitting
+    # data makes every score NaN), so rows with missing or non-finite KPIs are rejected, naming the rows (index labels)
+    invalid = ~np.isfinite(X)
+    if invalid.any():
+        columns = [FEATURES[j] for j in np.flatnonzero(invalid.any(axis=0))]
+        raise ValueError(f"Missing or non-finite {', '.join(columns)} in rows {_row_labels(np.flatnonzero(invalid.any(axis=1)), rows)}")
+    return X
+
+
+def bcp_code(value):
+    # BCP risk level 0 / 1 / 2 of one LOW / MEDIUM / HIGH label or level, None for anything else (another number, a
+    # boolean, a misspelt label, a missing value)
+    if isinstance(value, str):
+        return BCP_MAPPING.get(value)
+    if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, (bool, np.bool_)) and value in (0, 1, 2):
+        return int(value)
+    return None
+
+
+def bcp_codes(values, rows=None):
+    # int8 BCP risk levels of a column, by the same rule as bcp_code; rows with anything else are rejected, naming the
+    # rows (index labels) like check_finite
+    if pd.api.types.is_bool_dtype(values):
+        codes = np.full(len(values), -1, dtype=np.int8)
+    elif pd.api.types.is_numeric_dtype(values):
+        levels = pd.Series(values).to_numpy(dtype=float, na_value=np.nan)
+        codes = np.where(np.isin(levels, (0, 1, 2)), levels, -1).astype(np.int8)
+    else:
+        values = np.asarray(values, dtype=object)
+        codes = np.full(len(values), -1, dtype=np.int8)
+        for label, level in BCP_MAPPING.items():
+            codes[values == label] = level
+        # Columns mixing labels and levels (e.g. Excel cells typed as numbers) go through the scalar rule
+        for i in np.flatnonzero(codes < 0):
+            code = bcp_code(values[i])
+            codes[i] = -1 if code is None else code
+    invalid = np.flatnonzero(codes < 0)
+    if len(invalid):
+        found = pd.unique(pd.Series(np.asarray(values, dtype=object)[invalid]))[:5].tolist()
+        raise ValueError(f"BCP_risk must be one of {', '.join(BCP_LEVELS)} or 0, 1, 2, got {found} in rows {_row_labels(invalid, rows)}")
+    return codes
+
+
+def feature_matrix(df):
+    # (n, 5) float array of the raw KPIs; BCP risk may be given as labels or as 0 / 1 / 2
+    columns = [df[name].to_numpy(dtype=float) for name in FEATURES[:-1]] + [bcp_codes(df["BCP_risk"], df.index).astype(float)]
+    return check_finite(np.column_stack(columns), df.index)
+
+
+def fit_scaler(X):
+    # Same statistics as sklearn's StandardScaler: population std, constant columns left unscaled
+    mean = X.mean(axis=0)
+    scale = X.std(axis=0)
+    scale[scale == 0] = 1.0
+    return mean, scale
+
+
+def transform(X, mean, scale):
+    return (X - mean) / scale
+
+
+def inverse_transform(Z, mean, scale):
+    return Z * scale + mean
+
+
+def score(Z, weights=WEIGHTS):
+    return -(Z @ weights)
+
+
+def strength(scores, thresholds=THRESHOLDS):
+    low, high = thresholds
+    return np.where(scores <= low, 0, np.where(scores < high, 1, 2)).astype(np.int8)
+
+
+def score_frame(df, scaler=None, fit_on=None, weights=WEIGHTS, thresholds=THRESHOLDS):
+    # Score every row of df against a fixed (mean, scale) scaler, or fit one on fit_on (a DataFrame or feature
+    # matrix) or on df itself
+    X = feature_matrix(df)
+    if scaler is not None:
+        mean, scale = scaler
+    elif fit_on is None:
+        mean, scale = fit_scaler(X)
+    elif isinstance(fit_on, pd.DataFrame):
+        mean, scale = fit_scaler(feature_matrix(fit_on))
+    else:
+        mean, scale = fit_scaler(check_finite(np.asarray(fit_on, dtype=float)))
+
+    Z = transform(X, mean, scale)
+    scores = score(Z, weights)
+    strengths = strength(scores, thresholds)
+    required_scaled, required, bcp_with_negative = targets.solve_targets(Z, scores, strengths, mean, scale, weights, thresholds)
+
+    result = df.copy()
+    result["BCP_risk"] = X[:, 4].astype(np.int8)
+    result[SCALED_FEATURES] = Z
+    result["SCR_score"] = scores
+    result["SCR_Strength"] = strengths
+    result["SCR_Strength_Label"] = pd.Categorical.from_codes(strengths, list(STRENGTH_LABELS.values()))
+    result[REQUIRED_SCALED] = required_scaled
+    result[REQUIRED] = required
+    result["BCP Risk Required with negative"] = bcp_with_negative
+    return result
+
+
+def attach_country_risks(df):
+    # Fill in Fragility Index / Natural Disaster Risk from the country risk snapshot when only a country is given
+    if "Fragility Index" in df.columns and "Natural Disaster Risk" in df.columns:
+        return df
+    country_column = next((c for c in COUNTRY_COLUMNS if c in df.columns), None)
+    if country_column is None:
+        raise KeyError("Input needs 'Fragility Index' and 'Natural Disaster Risk' columns or a supplier country column")
+
+    import country_risk
+
+    snapshot = country_risk.get_snapshot()
+    df = df.copy()
+    df["Fragility Index"] = df[country_column].map(snapshot["fragility"])
+    df["Natural Disaster Risk"] = df[country_column].map(snapshot["natural_disaster"])
+    missing = df.loc[df["Fragility Index"].isna() | df["Natural Disaster Risk"].isna(), country_column].unique()
+    if len(missing):
+        raise IndexError(f"Countries not in the country risk snapshot: {', '.join(map(str, missing))}")
+    return df
+
+
+def read_table(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        return pd.read_parquet(path)
+    if extension in (".xlsx", ".xls"):
+        return pd.read_excel(path)
+    return pd.read_csv(path)
+
+
+def write_table(df, path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        df.to_parquet(path, index=False)
+    elif extension in (".xlsx", ".xls"):
+        df.to_excel(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a batch of supplier-material pairs for supply chain strength.")
+    parser.add_argument("input", help="CSV, Parquet or Excel file with one supplier per row")
+    parser.add_argument("-o", "--output", help="Where to write the scored rows (defaults to stdout as CSV)")
+    parser.add_argument("--model-version", type=int, help="Score with this version of the reference scaling model (default: current)")
+    parser.add_argument("--reference", help="Fit the scaler on this portfolio instead of using the reference scaling model")
+    parser.add_argument("--fit-on-input", action="store_true", help="Fit the scaler on the input rows instead of using the reference scaling model")
+    parser.add_argument("--profile", help="Score with the weights of this AHP weight profile instead of the default weights")
+    parser.add_argument("--rank", action="store_true", help="Add the percentile rank of each score within the reference portfolio")
+    args = parser.parse_args(argv)
+
+    df = attach_country_risks(read_table(args.input))
+    if args.rank and (args.reference or args.fit_on_input):
+        parser.error("--rank needs the reference scaling model")
+    weights = WEIGHTS
+    if args.profile:
+        import ahp
+
+        weights = ahp.get_weights(args.profile)
+    scaler, fit_on = None, None
+    if args.reference:
+        fit_on = read_table(args.reference)
+    elif not args.fit_on_input:
+        import scaler_model
+
+        model = scaler_model.load_model(args.model_version)
+        scaler = scaler_model.model_scaler(model)
+        print(f"Using scaling model {scaler_model.model_id(model)}", file=sys.stderr)
+
+    start = time.perf_counter()
+    result = score_frame(df, scaler=scaler, fit_on=fit_on, weights=weights)
+    elapsed = time.perf_counter() - start
+    if args.rank:
+        import portfolio
+
+        result["SCR_Percentile"] = portfolio.get_score_index(model, weights).percentile(result["SCR_score"].to_numpy())
+
+    if args.output:
+        write_table(result, args.output)
+    else:
+        result.to_csv(sys.stdout, index=False)
+    print(f"Scored {len(result)} rows in {elapsed * 1000:.1f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
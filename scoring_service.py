@@ -0,0 +1,376 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+from http import HTTPStatus
+
+import numpy as np
+
+import country_risk
+import portfolio
+import scaler_model
+import scoring
+import targets
+
+
+# ======================================== SCORING SERVICE ======================================================= #
+#
+# Headless HTTP interface to the same model as run_script, for sourcing tools and ERP jobs:
+#
+#     POST /score          {"Lead Time": 38, "Distance (km)": 837.4, "BCP_risk": "MEDIUM", "Supplier Country": "China"}
+#     POST /score/batch    {"suppliers": [{...}, {...}], "targets": false}
+#     POST /targets        same body as /score, plus the KPI values needed to reach the next band
+#     GET  /health
+#
+# Fragility Index and Natural Disaster Risk may be given directly instead of a country. Each worker is a single
+# asyncio event loop speaking HTTP/1.1 with keep-alive. Every request is validated into a row of raw KPIs as it
+# arrives, and the rows of all requests that arrived in the same loop iteration (or within --max-batch-wait) are
+# scored together in one vectorized call, so under load the cost per request is mostly HTTP parsing. The scaling
+# model, weights, country risk snapshot and portfolio score index are loaded before the workers are forked, so every
+# worker starts warm, and the workers share one listening socket.
+#
+#     python scoring_service.py --port 8765 --workers 4
+
+DEFAULT_PORT = 8765
+# A batch is scored once it has this many rows or its first request has waited this long (0: end of loop iteration)
+MAX_BATCH_ROWS = 4096
+MAX_BATCH_WAIT = 0.0
+# Requests larger than this are rejected rather than read into memory
+MAX_BODY_BYTES = 16 * 2 ** 20
+MAX_HEADER_BYTES = 64 * 2 ** 10
+# Idle keep-alive connections are closed after this many seconds
+KEEP_ALIVE_TIMEOUT = 75
+LISTEN_BACKLOG = 2048
+
+
+class RequestError(ValueError):
+    pass
+
+
+class MicroBatcher:
+    # Collects (rows, want_targets) items submitted from request coroutines and runs fn once per batch on the event
+    # loop; fn(X, target_rows) returns arrays with one entry per row of X (target_* arrays one per target row), which
+    # are sliced back per item
+    def __init__(self, fn, max_rows=MAX_BATCH_ROWS, max_wait=MAX_BATCH_WAIT):
+        self.fn = fn
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self.batches = 0
+        self.rows = 0
+        self._pending = []
+        self._pending_rows = 0
+        self._scheduled = None
+
+    def submit(self, X, want_targets=False):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((X, want_targets, future))
+        self._pending_rows += len(X)
+        if self._pending_rows >= self.max_rows:
+            self.flush()
+        elif self._scheduled is None:
+            self._scheduled = loop.call_later(self.max_wait, self.flush) if self.max_wait > 0 else loop.call_soon(self.flush)
+        return future
+
+    def flush(self):
+        if self._scheduled is not None:
+            self._scheduled.cancel()
+            self._scheduled = None
+        items, self._pending, self._pending_rows = self._pending, [], 0
+        if not items:
+            return
+        X = np.concatenate([item[0] for item in items]) if len(items) > 1 else items[0][0]
+        offsets = np.cumsum([0] + [len(item[0]) for item in items])
+        target_rows = np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i, item in enumerate(items) if item[1]] or [np.empty(0, dtype=np.int64)])
+        try:
+            result = self.fn(X, target_rows)
+        except Exception as e:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.rows += len(X)
+        target_offset = 0
+        for i, (_, want_targets, future) in enumerate(items):
+            start, end = offsets[i], offsets[i + 1]
+            item_result = {name: values[start:end] for name, values in result.items() if not name.startswith("target_")}
+            if want_targets:
+                n = end - start
+                item_result.update({name: values[target_offset:target_offset + n] for name, values in result.items() if name.startswith("target_")})
+                target_offset += n
+            if not future.done():
+                future.set_result(item_result)
+
+
+class ScoringService:
+    # Warm state shared by all requests of a worker: scaler, weights, country risks and the portfolio score index
+    def __init__(self, model=None, weights=scoring.WEIGHTS, thresholds=scoring.THRESHOLDS, max_batch_wait=MAX_BATCH_WAIT):
+        self.model = model or scaler_model.get_model()
+        self.mean, self.scale = scaler_model.model_scaler(self.model)
+        self.weights = np.asarray(weights, dtype=float)
+        self.thresholds = thresholds
+        self.snapshot = country_risk.get_snapshot()
+        self.index = portfolio.get_score_index(self.model, self.weights)
+        self.batcher = MicroBatcher(self.compute, max_wait=max_batch_wait)
+
+    def info(self):
+        return {
+            "status": "ok",
+            "model": scaler_model.model_id(self.model),
+            "weights": self.weights.tolist(),
+            "thresholds": list(self.thresholds),
+            "country_risk_version": self.snapshot.get("version"),
+            "portfolio_rows": len(self.index.overall),
+            "batches": self.batcher.batches,
+            "rows_scored": self.batcher.rows,
+        }
+
+    def supplier_row(self, record):
+        # Raw KPIs of one supplier in FEATURES order; raises RequestError with a message for the client
+        if not isinstance(record, dict):
+            raise RequestError("Each supplier must be a JSON object")
+        row = np.empty(len(scoring.FEATURES))
+        try:
+            row[0] = float(record["Lead Time"])
+            row[1] = float(record["Distance (km)"])
+            bcp = scoring.bcp_code(record["BCP_risk"])
+        except KeyError as e:
+            raise RequestError(f"Missing or unknown value for {e}") from None
+        except (TypeError, ValueError):
+            raise RequestError("Lead Time and Distance (km) must be numbers") from None
+        if bcp is None:
+            raise RequestError(f"BCP_risk must be one of {', '.join(scoring.BCP_LEVELS)} or 0, 1, 2, got {json.dumps(record['BCP_risk'])}")
+        row[4] = bcp
+        if "Fragility Index" in record and "Natural Disaster Risk" in record:
+            try:
+                row[2] = float(record["Fragility Index"])
+                row[3] = float(record["Natural Disaster Risk"])
+            except (TypeError, ValueError):
+                raise RequestError("Fragility Index and Natural Disaster Risk must be numbers") from None
+        else:
+            country = next((record[c] for c in scoring.COUNTRY_COLUMNS if c in record), None)
+            if country is None:
+                raise RequestError(f"Give 'Fragility Index' and 'Natural Disaster Risk' or one of {scoring.COUNTRY_COLUMNS}")
+            try:
+                row[2], row[3] = country_risk.lookup_country(country, self.snapshot)
+            except (IndexError, TypeError):
+                raise RequestError(f"Country {country!r} is not in the country risk snapshot") from None
+        if not np.isfinite(row).all():
+            raise RequestError("KPI values must be finite")
+        return row
+
+    def compute(self, X, target_rows):
+        # One vectorized pass over every row in the batch
+        Z = scoring.transform(X, self.mean, self.scale)
+        scores = scoring.score(Z, self.weights)
+        strengths = scoring.strength(scores, self.thresholds)
+        result = {
+            "score": scores,
+            "strength": strengths,
+            "percentile": self.index.percentile(scores),
+        }
+        if len(target_rows):
+            _, required, bcp_with_negative = targets.solve_targets(Z, scores, strengths, self.mean, self.scale, self.weights, self.thresholds, rows=target_rows)
+            result["target_required"] = required
+            result["target_bcp_with_negative"] = bcp_with_negative
+        return result
+
+    async def score(self, records, want_targets=False):
+        if not records:
+            return []
+        X = np.vstack([self.supplier_row(record) for record in records])
+        result = await self.batcher.submit(X, want_targets)
+        return [self._format(result, i, want_targets) for i in range(len(X))]
+
+    async def handle(self, method, path, body):
+        # (status, payload) for one request
+        if method == "GET" and path == "/health":
+            return 200, self.info()
+        if path not in ("/score", "/targets", "/score/batch"):
+            return 404, {"error": f"Unknown endpoint {path}"}
+        if method != "POST":
+            return 405, {"error": f"{path} only accepts POST"}
+        try:
+            try:
+                payload = json.loads(body or b"null")
+            except ValueError:
+                raise RequestError("Request body is not valid JSON") from None
+            if path == "/score":
+                return 200, (await self.score([payload]))[0]
+            if path == "/targets":
+                return 200, (await self.score([payload], want_targets=True))[0]
+            suppliers = payload.get("suppliers") if isinstance(payload, dict) else None
+            if not isinstance(suppliers, list):
+                raise RequestError("Batch requests need a 'suppliers' list")
+            return 200, {"results": await self.score(suppliers, want_targets=bool(payload.get("targets")))}
+        except RequestError as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+    @staticmethod
+    def _format(result, i, want_targets):
+        strength = int(result["strength"][i])
+        item = {
+            "SCR_score": float(result["score"][i]),
+            "SCR_Strength": strength,
+            "SCR_Strength_Label": scoring.STRENGTH_LABELS[strength],
+            "SCR_Percentile": float(result["percentile"][i]),
+        }
+        if want_targets:
+            if targets.has_target(strength):
+                required = result["target_required"][i]
+                item["Target Strength"] = scoring.STRENGTH_LABELS[strength + 1]
+                item["Targets"] = {name: float(value) for name, value in zip(scoring.REQUIRED, required)}
+                item["Targets"]["BCP Risk Required with negative"] = int(result["target_bcp_with_negative"][i])
+            else:
+                item["Target Strength"] = None
+                item["Targets"] = None
+        return item
+
+
+
+def _response(status, payload, keep_alive):
+    body = json.dumps(payload).encode()
+    head = (
+        f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+        "Server: SCRScoring/1.0\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode("latin-1") + body
+
+
+async def _read_request(reader):
+    # (method, path, headers, body) of the next request on the connection, or None when the client is done
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise RequestError("Request headers too large") from None
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ", 2)
+    except ValueError:
+        raise RequestError("Malformed request line") from None
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise RequestError("Chunked request bodies are not supported, send Content-Length")
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise RequestError("Invalid Content-Length") from None
+    if length > MAX_BODY_BYTES:
+        raise RequestError(f"Request body larger than {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    headers[":version"] = version
+    return method, target.split("?", 1)[0], headers, body
+
+
+def _keep_alive(headers):
+    connection = headers.get("connection", "").lower()
+    if headers[":version"] == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+
+async def _handle_connection(service, reader, writer):
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+            except RequestError as e:
+                writer.write(_response(400, {"error": str(e)}, False))
+                break
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            if request is None:
+                break
+            method, path, headers, body = request
+            keep_alive = _keep_alive(headers)
+            status, payload = await service.handle(method, path, body)
+            writer.write(_response(status, payload, keep_alive))
+            if not keep_alive:
+                break
+            await writer.drain()
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def _serve_socket(service, sock):
+    server = await asyncio.start_server(lambda r, w: _handle_connection(service, r, w), sock=sock, limit=MAX_HEADER_BYTES)
+    async with server:
+        await server.serve_forever()
+
+
+def _serve_worker(service, sock):
+    # One event loop per worker process, created after the fork
+    try:
+        asyncio.run(_serve_socket(service, sock))
+    except KeyboardInterrupt:
+        pass
+
+
+def make_socket(host="127.0.0.1", port=DEFAULT_PORT):
+    sock = socket.create_server((host, port), backlog=LISTEN_BACKLOG, reuse_port=False)
+    sock.setblocking(False)
+    return sock
+
+
+def serve(host="127.0.0.1", port=DEFAULT_PORT, workers=1, weights=scoring.WEIGHTS, model=None, max_batch_wait=MAX_BATCH_WAIT):
+    # Warm everything up once, bind, then fork workers sharing the listening socket (pre-fork, like gunicorn)
+    service = ScoringService(model, weights, max_batch_wait=max_batch_wait)
+    sock = make_socket(host, port)
+    children = []
+    if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        for _ in range(workers - 1):
+            child = context.Process(target=_serve_worker, args=(service, sock), daemon=True)
+            child.start()
+            children.append(child)
+    print(f"Scoring service on http://{host}:{sock.getsockname()[1]} with {len(children) + 1} worker(s), model {scaler_model.model_id(service.model)}", file=sys.stderr, flush=True)
+    try:
+        _serve_worker(service, sock)
+    finally:
+        for child in children:
+            child.terminate()
+        sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve supply chain strength scores over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes sharing the port")
+    parser.add_argument("--model-version", type=int, help="Score with this version of the reference scaling model (default: current)")
+    parser.add_argument("--profile", help="Score with the weights of this AHP weight profile instead of the default weights")
+    parser.add_argument("--max-batch-wait", type=float, default=MAX_BATCH_WAIT, help="Seconds a batch waits for more requests before it is scored (0: score what arrived in one loop iteration)")
+    args = parser.parse_args(argv)
+
+    weights = scoring.WEIGHTS
+    if args.profile:
+        import ahp
+
+        weights = ahp.get_weights(args.profile)
+    model = scaler_model.load_model(args.model_version) if args.model_version else None
+    # Terminate cleanly (and take the forked workers down) on SIGTERM as well as Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    serve(args.host, args.port, args.workers, weights, model, args.max_batch_wait)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+import scoring
+
+
+# ======================================== SENSITIVITY SWEEPS ======================================================= #
+#
+# Re-scores the whole portfolio under many weight vectors and band cut-offs at once. Scores for P parameter sets are
+# one (N, 5) x (5, P) matrix product, and bands come from broadcasting the scores against each set's thresholds, so
+# there is no loop over rows. The portfolio is processed in row blocks to keep the (N, P) intermediates bounded.
+# Results are cached per portfolio and parameter set.
+
+# Upper bound on the number of (row, parameter set) cells held in memory at once
+BLOCK_CELLS = 8_000_000
+CACHE_SIZE = 64
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _key(*arrays):
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=float)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def _cached(key, compute):
+    with _cache_lock:
+        instrumentation.cache_access("sensitivity", key in _cache)
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    value = compute()
+    with _cache_lock:
+        _cache[key] = value
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return value
+
+
+def band_changes(Z, W, T, base_weights=scoring.WEIGHTS, base_thresholds=scoring.THRESHOLDS):
+    # For P parameter sets (rows of W, (P, 5) weights, and T, (P, 2) thresholds), the number of suppliers that move
+    # down and up a band compared with the base weights and thresholds
+    W, T = np.atleast_2d(W), np.atleast_2d(T)
+
+    def compute():
+        base = scoring.strength(scoring.score(Z, base_weights), base_thresholds)
+        down = np.zeros(len(W), dtype=np.int64)
+        up = np.zeros(len(W), dtype=np.int64)
+        block = max(1, BLOCK_CELLS // len(W))
+        for start in range(0, len(Z), block):
+            scores = -(Z[start:start + block] @ W.T)
+            bands = (scores > T[:, 0]).astype(np.int8) + (scores >= T[:, 1])
+            delta = bands - base[start:start + block, None]
+            down += (delta < 0).sum(axis=0)
+            up += (delta > 0).sum(axis=0)
+        return down, up
+
+    return _cached(_key(Z, W, T, base_weights, base_thresholds), compute)
+
+
+def perturbed_weights(base_weights, feature, deltas):
+    # Scale one weight by (1 + delta) for every delta and renormalise to the sum of the base weights (not 1: the
+    # rounded AHP weights sum to 1.001), so a zero change reproduces the base bands exactly
+    base_weights = np.asarray(base_weights, dtype=float)
+    W = np.tile(base_weights, (len(deltas), 1))
+    W[:, feature] *= 1 + np.asarray(deltas, dtype=float)
+    return W * (base_weights.sum() / W.sum(axis=1, keepdims=True))
+
+
+def random_weights(base_weights, n, concentration=100.0, seed=0):
+    # Dirichlet draws centred on the base weights; higher concentration means smaller perturbations. Scaled to the
+    # sum of the base weights, like perturbed_weights.
+    base_weights = np.asarray(base_weights, dtype=float)
+    rng = np.random.default_rng(seed)
+    return rng.dirichlet(base_weights * concentration, size=n) * base_weights.sum()
+
+
+def weight_sensitivity(Z, deltas, base_weights=scoring.WEIGHTS, thresholds=scoring.THRESHOLDS):
+    # Suppliers changing band when each weight alone is perturbed: one row per KPI, one column per delta
+    W = np.vstack([perturbed_weights(base_weights, j, deltas) for j in range(len(base_weights))])
+    T = np.tile(thresholds, (len(W), 1))
+    down, up = band_changes(Z, W, T, base_weights, thresholds)
+    shape = (len(base_weights), len(deltas))
+    index = pd.Index(scoring.FEATURES, name="KPI")
+    columns = pd.Index(deltas, name="Weight change")
+    return pd.DataFrame((down + up).reshape(shape), index=index, columns=columns), pd.DataFrame(down.reshape(shape), index=index, columns=columns), pd.DataFrame(up.reshape(shape), index=index, columns=columns)
+
+
+def threshold_sensitivity(Z, low_values, high_values, weights=scoring.WEIGHTS, base_thresholds=scoring.THRESHOLDS):
+    # Suppliers changing band for every (LOW/MEDIUM cut-off, MEDIUM/HIGH cut-off) pair; invalid pairs are NaN
+    low_grid, high_grid = np.meshgrid(low_values, high_values, indexing="ij")
+    T = np.column_stack([low_grid.ravel(), high_grid.ravel()])
+    W = np.tile(weights, (len(T), 1))
+    down, up = band_changes(Z, W, T, weights, base_thresholds)
+    changes = (down + up).astype(float)
+    changes[T[:, 0] >= T[:, 1]] = np.nan
+    return pd.DataFrame(changes.reshape(low_grid.shape), index=pd.Index(low_values, name="LOW cut-off"), columns=pd.Index(high_values, name="HIGH cut-off"))
+
+
+def random_sensitivity(Z, n, concentration=100.0, seed=0, base_weights=scoring.WEIGHTS, thresholds=scoring.THRESHOLDS):
+    # Band changes for n random weight vectors around the base weights
+    W = random_weights(base_weights, n, concentration, seed)
+    T = np.tile(thresholds, (n, 1))
+    down, up = band_changes(Z, W, T, base_weights, thresholds)
+    result = pd.DataFrame(W, columns=scoring.FEATURES)
+    result["Moved down"] = down
+    result["Moved up"] = up
+    result["Changed band"] = down + up
+    return result
@@ -0,0 +1,31 @@
+import json
+import os
+import tempfile
+
+
+# ======================================== LOCAL STORAGE ======================================================= #
+#
+# Shared paths and helpers for everything the simulator keeps on disk: bundled data under data/ and generated state
+# (snapshots, caches, models) under the cache directory.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+CACHE_DIR = os.environ.get("SCR_CACHE_DIR", os.path.join(BASE_DIR, ".cache"))
+
+
+def read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_json_atomic(path, data):
+    # Write next to the target and rename, so a reader never sees a half-written file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
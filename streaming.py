@@ -0,0 +1,321 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import scoring
+import targets
+
+
+# ======================================== STREAMING SCORING ======================================================= #
+#
+# Scores portfolio and scenario files of any size in fixed-size chunks, so memory stays bounded by the chunk size
+# rather than the file size. Each chunk is held as compact typed arrays instead of a wide float64 / object frame:
+# float32 KPIs, int8 BCP levels and strength bands, and an int16 code into the country risk table in place of the
+# country name. Scores, bands and target KPIs are computed per chunk and appended to the output as they are ready.
+#
+#     python streaming.py scenarios.csv -o scored.parquet --chunk-rows 200000
+#     python streaming.py portfolio.parquet -o scored.csv --fit-on-input --rank
+
+DEFAULT_CHUNK_ROWS = 100_000
+KPI_COLUMNS = scoring.FEATURES[:4]
+RISK_COLUMNS = ["Fragility Index", "Natural Disaster Risk"]
+
+
+class CountryCodes:
+    # Country names of the risk snapshot as one fixed categorical vocabulary, with the two risk tables as float32
+    # arrays in the same order, so a chunk's risks are a take on its country codes
+    def __init__(self, snapshot):
+        self.names = sorted(set(snapshot["fragility"]) | set(snapshot["natural_disaster"]))
+        self.fragility = np.array([snapshot["fragility"].get(c, np.nan) for c in self.names], dtype=np.float32)
+        self.natural_disaster = np.array([snapshot["natural_disaster"].get(c, np.nan) for c in self.names], dtype=np.float32)
+
+    def encode(self, countries):
+        # int16 codes, -1 for countries not in the snapshot; raises IndexError naming them like attach_country_risks
+        codes = pd.Categorical(countries, categories=self.names).codes.astype(np.int16)
+        known = codes >= 0
+        missing = np.zeros(len(codes), dtype=bool)
+        missing[known] = np.isnan(self.fragility[codes[known]]) | np.isnan(self.natural_disaster[codes[known]])
+        missing |= ~known
+        if missing.any():
+            names = pd.unique(np.asarray(countries, dtype=object)[missing])
+            raise IndexError(f"Countries not in the country risk snapshot: {', '.join(map(str, names))}")
+        return codes
+
+    def risks(self, codes):
+        return self.fragility[codes], self.natural_disaster[codes]
+
+
+class SupplierChunk:
+    # One chunk of suppliers: kpis (n, 4) float32 in KPI_COLUMNS order, bcp (n,) int8, country (n,) int16 codes or
+    # None when the file carries the risk values itself, and the other input columns passed through unchanged
+    __slots__ = ("kpis", "bcp", "country", "passthrough")
+
+    def __init__(self, kpis, bcp, country=None, passthrough=None):
+        self.kpis = kpis
+        self.bcp = bcp
+        self.country = country
+        self.passthrough = passthrough
+
+    def __len__(self):
+        return len(self.bcp)
+
+    @property
+    def nbytes(self):
+        return self.kpis.nbytes + self.bcp.nbytes + (self.country.nbytes if self.country is not None else 0)
+
+    @classmethod
+    def from_frame(cls, df, countries=None):
+        country_column = next((c for c in scoring.COUNTRY_COLUMNS if c in df.columns), None)
+        has_risks = all(c in df.columns for c in RISK_COLUMNS)
+        if not has_risks and (country_column is None or countries is None):
+            raise KeyError("Input needs 'Fragility Index' and 'Natural Disaster Risk' columns or a supplier country column")
+
+        kpis = np.empty((len(df), 4), dtype=np.float32)
+        kpis[:, 0] = df["Lead Time"].to_numpy(dtype=np.float32)
+        kpis[:, 1] = df["Distance (km)"].to_numpy(dtype=np.float32)
+        country = None
+        if has_risks:
+            kpis[:, 2] = df["Fragility Index"].to_numpy(dtype=np.float32)
+            kpis[:, 3] = df["Natural Disaster Risk"].to_numpy(dtype=np.float32)
+        else:
+            country = countries.encode(df[country_column].to_numpy())
+            kpis[:, 2], kpis[:, 3] = countries.risks(country)
+
+        scoring.check_finite(kpis, df.index)
+        passthrough = df.drop(columns=[c for c in scoring.FEATURES if c in df.columns])
+        return cls(kpis, scoring.bcp_codes(df["BCP_risk"], df.index), country, passthrough)
+
+    def feature_matrix(self):
+        # float64 (n, 5) for the arithmetic, only ever one chunk at a time
+        X = np.empty((len(self), 5))
+        X[:, :4] = self.kpis
+        X[:, 4] = self.bcp
+        return X
+
+
+def _csv_dtypes(path):
+    # float32 straight from the parser for the KPI columns the file actually has, and text for the passthrough columns:
+    # types inferred per chunk would differ between chunks (IDs that start numeric, a column empty in one chunk)
+    header = pd.read_csv(path, nrows=0).columns
+    return {c: np.float32 if c in KPI_COLUMNS else str for c in header if c != "BCP_risk"}
+
+
+def _passthrough_as_text(df):
+    # Same rule for Excel, whose cells arrive as Python objects of whatever type each one holds
+    for c in df.columns:
+        if c not in KPI_COLUMNS and c != "BCP_risk":
+            df[c] = df[c].astype("str")
+    return df
+
+
+def read_frames(path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    # The input file as DataFrames of at most chunk_rows rows, never holding more than one at a time
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    elif extension in (".xlsx", ".xls"):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = [str(c) if c is not None else f"Unnamed: {i}" for i, c in enumerate(next(rows))]
+            buffer = []
+            for row in rows:
+                buffer.append(row)
+                if len(buffer) == chunk_rows:
+                    yield _passthrough_as_text(pd.DataFrame.from_records(buffer, columns=header))
+                    buffer = []
+            if buffer:
+                yield _passthrough_as_text(pd.DataFrame.from_records(buffer, columns=header))
+        finally:
+            workbook.close()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows, dtype=_csv_dtypes(path))
+
+
+def read_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS, countries=None):
+    # Rows numbered through the whole file, so errors name the same rows whatever the chunk size
+    start = 0
+    for df in read_frames(path, chunk_rows):
+        df.index = pd.RangeIndex(start, start + len(df))
+        start += len(df)
+        yield SupplierChunk.from_frame(df, countries)
+
+
+def score_chunk(chunk, mean, scale, weights=scoring.WEIGHTS, thresholds=scoring.THRESHOLDS, index=None):
+    # Result columns for one chunk: the passthrough columns, the compact inputs, score, band and target KPIs
+    Z = scoring.transform(chunk.feature_matrix(), mean, scale)
+    scores = scoring.score(Z, weights)
+    strengths = scoring.strength(scores, thresholds)
+    _, required, bcp_with_negative = targets.solve_targets(Z, scores, strengths, mean, scale, weights, thresholds)
+
+    result = chunk.passthrough.reset_index(drop=True)
+    for j, name in enumerate(KPI_COLUMNS):
+        result[name] = chunk.kpis[:, j]
+    result["BCP_risk"] = chunk.bcp
+    result["SCR_score"] = scores
+    result["SCR_Strength"] = strengths
+    result["SCR_Strength_Label"] = pd.Categorical.from_codes(strengths, list(scoring.STRENGTH_LABELS.values()))
+    for j, name in enumerate(scoring.REQUIRED):
+        result[name] = required[:, j].astype(np.float32)
+    result["BCP Risk Required with negative"] = bcp_with_negative.astype(np.int8)
+    if index is not None:
+        result["SCR_Percentile"] = index.percentile(scores).astype(np.float32)
+    return result
+
+
+class _ArrowWriter:
+    # Appends chunks through a pyarrow writer whose schema is fixed by the first chunk; the readers keep the column
+    # types the same from chunk to chunk. Arrow's CSV writer is several times faster than DataFrame.to_csv, which
+    # would otherwise be the slowest step of the whole pipeline. Files are written next to the target and renamed
+    # by close(), so a failed run never leaves a half-written output behind.
+    def __init__(self, path, csv):
+        self._path = path
+        self._csv = csv
+        self._writer = None
+        self._schema = None
+        self._tmp_path = None
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            fd, self._tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+            os.close(fd)
+
+    def _open(self, schema):
+        import pyarrow.csv
+        import pyarrow.parquet
+
+        if not self._csv:
+            return pyarrow.parquet.ParquetWriter(self._tmp_path, schema)
+        sink = self._tmp_path if self._path else sys.stdout.buffer
+        return pyarrow.csv.CSVWriter(sink, schema, write_options=pyarrow.csv.WriteOptions(quoting_style="needed"))
+
+    def write(self, df):
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            self._schema = table.schema
+            self._writer = self._open(self._schema)
+        # One row group (Parquet) or block of lines (CSV) per chunk
+        self._writer.write_table(table.cast(self._schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._path is None:
+            sys.stdout.flush()
+        else:
+            os.replace(self._tmp_path, self._path)
+
+    def abort(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._tmp_path is not None and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def open_writer(path):
+    # CSV or Parquet by extension; CSV to stdout when path is None
+    extension = os.path.splitext(path)[1].lower() if path else ""
+    if extension in (".xlsx", ".xls"):
+        raise ValueError("Excel output cannot be written incrementally; use .csv or .parquet")
+    return _ArrowWriter(path, csv=extension != ".parquet")
+
+
+def scan_model(path, chunk_rows=DEFAULT_CHUNK_ROWS, countries=None):
+    # Scaling model of the whole file in one streaming pass, folding each chunk in with the parallel Welford update
+    import scaler_model
+
+    model = None
+    for chunk in read_chunks(path, chunk_rows, countries):
+        X = chunk.feature_matrix()
+        model = scaler_model.fit_model(X, source=os.path.basename(path)) if model is None else scaler_model.update_model(model, X)
+    if model is None:
+        raise ValueError(f"{path} has no rows")
+    return model
+
+
+def score_file(path, output=None, scaler=None, weights=scoring.WEIGHTS, thresholds=scoring.THRESHOLDS, chunk_rows=DEFAULT_CHUNK_ROWS, index=None, countries=None):
+    # Streams path through the scorer into output (CSV to stdout when None); returns row and band counts
+    mean, scale = scaler
+    writer = open_writer(output)
+    rows, chunks = 0, 0
+    bands = np.zeros(3, dtype=np.int64)
+    try:
+        for chunk in read_chunks(path, chunk_rows, countries):
+            result = score_chunk(chunk, mean, scale, weights, thresholds, index)
+            writer.write(result)
+            rows += len(chunk)
+            chunks += 1
+            bands += np.bincount(result["SCR_Strength"].to_numpy(), minlength=3)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return {"rows": rows, "chunks": chunks, "bands": {scoring.STRENGTH_LABELS[k]: int(v) for k, v in enumerate(bands)}}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS; the resource module does not exist on Windows
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a portfolio or scenario file of any size in bounded memory.")
+    parser.add_argument("input", help="CSV, Parquet or Excel file with one supplier per row")
+    parser.add_argument("-o", "--output", help="CSV or Parquet file to write the scored rows to (defaults to stdout as CSV)")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="Rows scored per chunk; bounds memory use")
+    parser.add_argument("--model-version", type=int, help="Score with this version of the reference scaling model (default: current)")
+    parser.add_argument("--fit-on-input", action="store_true", help="Fit the scaler on the input file in an extra streaming pass")
+    parser.add_argument("--profile", help="Score with the weights of this AHP weight profile instead of the default weights")
+    parser.add_argument("--rank", action="store_true", help="Add the percentile rank of each score within the reference portfolio")
+    args = parser.parse_args(argv)
+    if args.rank and args.fit_on_input:
+        parser.error("--rank needs the reference scaling model")
+    if args.output and os.path.splitext(args.output)[1].lower() in (".xlsx", ".xls"):
+        parser.error("Excel output cannot be written incrementally; use .csv or .parquet")
+
+    import country_risk
+    import scaler_model
+
+    countries = CountryCodes(country_risk.get_snapshot())
+    weights = scoring.WEIGHTS
+    if args.profile:
+        import ahp
+
+        weights = ahp.get_weights(args.profile)
+    if args.fit_on_input:
+        model = scan_model(args.input, args.chunk_rows, countries)
+    else:
+        model = scaler_model.load_model(args.model_version)
+    print(f"Using scaling model {scaler_model.model_id(model)}", file=sys.stderr)
+    index = None
+    if args.rank:
+        import portfolio
+
+        index = portfolio.get_score_index(model, weights)
+
+    start = time.perf_counter()
+    summary = score_file(args.input, args.output, scaler_model.model_scaler(model), weights, chunk_rows=args.chunk_rows, index=index, countries=countries)
+    elapsed = time.perf_counter() - start
+    bands = ", ".join(f"{count} {label}" for label, count in summary["bands"].items())
+    peak = peak_rss_mb()
+    print(f"Scored {summary['rows']} rows in {summary['chunks']} chunks in {elapsed:.2f} s ({bands})" + (f"; peak RSS {peak:.0f} MB" if peak is not None else ""), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,50 @@
+import threading
+
 import streamlit as st
 from streamlit_option_menu import option_menu
-import pandas as pd
-from sklearn.preprocessing import StandardScaler
-import math
-import numpy as np
-import requests
-from bs4 import BeautifulSoup
+import country_risk
+import instrumentation
+
+# pandas, numpy and the scoring modules are imported inside the functions that use them, so the sidebar and the
+# iframe-only pages paint without loading them; the warm-up below imports them in the background instead
+
+
+# ======================================== WARM-UP ======================================================= #
+#
+# The scaling model, the country-risk snapshot and the scored portfolio are process-wide caches in their own
+# modules, so warming them once serves every session. Streamlit has no server-start hook, so the warm-up is started
+# on the first script run of the process, in a background thread that does not hold up the first paint.
+
+def warm_up():
+    import ahp
+    import montecarlo
+    import portfolio
+    import scaler_model
+    import targets
+
+    with instrumentation.run("warm_up"):
+        country_risk.get_snapshot()
+        portfolio.get_scored_portfolio(scaler_model.get_model(), ahp.get_weights(ahp.DEFAULT_PROFILE))
+
+
+def _warm_up_quietly():
+    # A failed warm-up only means the first simulation builds the caches itself, and reports the error there
+    try:
+        warm_up()
+    except Exception:
+        pass
 
 
-# Function to render the Supply Chain Resilience Calculator page
+@st.cache_resource(show_spinner=False)
+def start_warm_up():
+    thread = threading.Thread(target=_warm_up_quietly, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+# Function to render the Supply Chain Resilience Calculator page; as a fragment, its widgets and Simulate rerun only
+# this page and not the sidebar and navigation around it
+@st.fragment
 def render_calculator_page():
     st.title("Supply Chain Resilience Simulator")
     st.write("")
@@ -33,6 +69,13 @@ def render_calculator_page():
     # input5 = st.number_input("Natural Disaster Risk of the country of the supplier (%)", 0.0)
     input6 = st.selectbox("__Supplier Country__", ['Albania', 'Algeria', 'Angola', 'Antigua and Barbuda', 'Argentina', 'Armenia', 'Australia', 'Austria', 'Azerbaijan', 'Bahamas', 'Bahrain', 'Bangladesh', 'Barbados', 'Belarus', 'Belgium', 'Belize', 'Benin', 'Bhutan', 'Bolivia', 'Bosnia and Herzegovina', 'Botswana', 'Brazil', 'Brunei', 'Bulgaria', 'Burkina Faso', 'Burundi', 'Cambodia', 'Cameroon', 'Canada', 'Cape Verde', 'Central African Republic', 'Chad', 'Chile', 'China', 'Colombia', 'Comoros', 'Congo', 'Costa Rica', 'Croatia', 'Cuba', 'Cyprus', 'Czechia', 'Denmark', 'Djibouti', 'Dominica', 'Dominican Republic', 'DR Congo', 'East Timor', 'Ecuador', 'Egypt', 'El Salvador', 'Equatorial Guinea', 'Eritrea', 'Estonia', 'Eswatini', 'Ethiopia', 'Fiji', 'Finland', 'France', 'Gabon', 'Gambia', 'Georgia', 'Germany', 'Ghana', 'Greece', 'Grenada', 'Guatemala', 'Guinea', 'Guinea-Bissau', 'Guyana', 'Haiti', 'Honduras', 'Hungary', 'Iceland', 'India', 'Indonesia', 'Iran', 'Iraq', 'Ireland', 'Israel', 'Italy', 'Ivory Coast', 'Jamaica', 'Japan', 'Jordan', 'Kazakhstan', 'Kenya', 'Kiribati', 'Kuwait', 'Kyrgyzstan', 'Laos', 'Latvia', 'Lebanon', 'Lesotho', 'Liberia', 'Libya', 'Liechtenstein', 'Lithuania', 'Luxembourg', 'Madagascar', 'Malawi', 'Malaysia', 'Maldives', 'Mali', 'Malta', 'Marshall Islands', 'Mauritania', 'Mauritius', 'Mexico', 'Micronesia', 'Moldova', 'Monaco', 'Mongolia', 'Montenegro', 'Morocco', 'Mozambique', 'Myanmar', 'Namibia', 'Nauru', 'Nepal', 'Netherlands', 'New Zealand', 'Nicaragua', 'Niger', 'Nigeria', 'North Korea', 'North Macedonia', 'Norway', 'Oman', 'Pakistan', 'Palau', 'Panama', 'Papua New Guinea', 'Paraguay', 'Peru', 'Philippines', 'Poland', 'Portugal', 'Qatar', 'Romania', 'Russia', 'Rwanda', 'Saint Kitts and Nevis', 'Saint Lucia', 'Saint Vincent and the Grenadines', 'Samoa', 'San Marino', 'São Tomé and Príncipe', 'Saudi Arabia', 'Senegal', 'Serbia', 'Seychelles', 'Sierra Leone', 'Singapore', 'Slovakia', 'Slovenia', 'Solomon Islands', 'Somalia', 'South Africa', 'South Korea', 'South Sudan', 'Spain', 'Sri Lanka', 'Sudan', 'Suriname', 'Sweden', 'Switzerland', 'Syria', 'Tajikistan', 'Tanzania', 'Thailand', 'Togo', 'Tonga', 'Trinidad and Tobago', 'Tunisia', 'Turkey', 'Turkmenistan', 'Tuvalu', 'Uganda', 'Ukraine', 'United Arab Emirates', 'United Kingdom', 'United States', 'Uruguay', 'Uzbekistan', 'Vanuatu', 'Venezuela', 'Vietnam', 'Yemen', 'Zambia', 'Zimbabwe'], index=None, placeholder="Choose a country", help="The selected country will determine the _Fragility Index_ and _Natural Disaster Risk_ KPIs")
     st.write("")
+    with st.expander("Uncertainty (Monte Carlo)"):
+        uncertainty_enabled = st.toggle("Simulate uncertain KPIs", help="Scores the supplier on many random draws of the KPIs and reports how likely each Supply Chain Strength is.")
+        input11 = st.number_input("Lead Time standard deviation (:blue[days])", min_value=0.0, value=0.0, step=1.0)
+        input12 = st.number_input("Distance standard deviation (:blue[km])", min_value=0.0, value=0.0, step=10.0)
+        input13 = st.number_input("Country risk revision standard deviation (:blue[%])", min_value=0.0, value=0.0, step=1.0, help="Relative uncertainty applied to both the _Fragility Index_ and the _Natural Disaster Risk_.")
+    uncertainty = {"lead_time_std": input11, "distance_std": input12, "country_risk_std": input13 / 100} if uncertainty_enabled else None
+    st.write("")
 
     # Button to trigger the script
     if st.button("Simulate", type="primary"):
@@ -55,89 +98,70 @@ def render_calculator_page():
         else:
             # Call the Python script with the user inputs
             try:
-                run_script(input1, input2, input3, input6)
+                with instrumentation.run("simulate", country=input6, uncertainty=uncertainty is not None) as simulation:
+                    # Kept for this session's diagnostics; the run is filled in as the simulation goes
+                    st.session_state["last_simulation"] = simulation
+                    run_script(input1, input2, input3, input6, uncertainty)
             except PermissionError as e:
                 st.error(f"Please close the file in the following path: {e}")
             except IndexError:
                 st.warning("Selected country is not currently in the database so _Fragility Index_ and _Natural Disaster Risk_ cannot be retrieved, please select a different one.")
 
-def run_script(input1, input2, input3, input6):
+    # Part of the fragment and rendered after the results, so it follows every Simulate; a fragment cannot write
+    # to the sidebar, where the toggle is
+    if st.session_state.get("show_diagnostics"):
+        with st.expander("Diagnostics", expanded=True):
+            render_diagnostics()
+
+def run_script(input1, input2, input3, input6, uncertainty=None):
     # Your Python script logic here
+    import pandas as pd
+    import portfolio
+    import scaler_model
+    import scoring
+    import targets
 
     
     # ======================================== COUNTRY RISKS ======================================================= #
     
 
-    # Replace with the URL of the Wikipedia page containing the table
-    url1 = "https://en.wikipedia.org/wiki/List_of_countries_by_Fragile_States_Index"
-    url2 = "https://en.wikipedia.org/wiki/List_of_countries_by_natural_disaster_risk"
-
-    response1 = requests.get(url1, verify=False)
-    soup1 = BeautifulSoup(response1.text, "html.parser")
-    response2 = requests.get(url2, verify=False)
-    soup2 = BeautifulSoup(response2.text, "html.parser")
- 
-    # # Find and extract the table containing the country data
-    table1 = soup1.find("table", {"class": "wikitable sortable"})
-    table2 = soup2.find("table", {"class": "wikitable sortable"})
-   
-    # # # Initialize empty dictionaries to store data
-    country_data1 = {}
-    country_data2 = {}
-    
-    # # Loop through rows in the table and extract data
-    for row in table1.find_all("tr")[1:]:      #<tr> is table row, <td> is table cell and <th> is table header
-        columns1 = row.find_all("td")
-        country1 = columns1[1].text.strip()
-        score1 = columns1[2].text.strip()
-        country_data1[country1] = score1
-    for row in table2.find_all("tr")[1:]:      #<tr> is table row, <td> is table cell and <th> is table header
-        columns2 = row.find_all("td")
-        country2 = columns2[1].text.strip()
-        score2 = columns2[2].text.strip()
-        country_data2[country2] = score2
- 
-    # # # Create a DataFrame from the dictionary
-    df_fragility = pd.DataFrame(list(country_data1.items()), columns=["Manufacturer Country", "Fragility Index"])
-    df_naturaldisaster = pd.DataFrame(list(country_data2.items()), columns=["Manufacturer Country", "Natural Disaster Risk"])
-    df_naturaldisaster['Natural Disaster Risk'] = df_naturaldisaster['Natural Disaster Risk'].str.replace('%', '').astype(float)
-
-    # Get Fragility Index and Natural Disaster Risk for the selected country
-    input9 = df_fragility[df_fragility["Manufacturer Country"] == input6]["Fragility Index"].values[0]
-    input10 = df_naturaldisaster[df_naturaldisaster["Manufacturer Country"] == input6]["Natural Disaster Risk"].values[0]
-
-
-    st.metric("","")
-
-    with st.expander("See Explanation"):
-        st.divider()
-        st.write("__Current KPIs:__ Current values for all 5 introduced KPIs.")
-        st.divider()
-        st.write("__Current Supply Chain Strength:__ (:green[HIGH], :orange[MEDIUM] or :red[LOW]) How strong the current supply chain is, with a percentage orientation that ranks the result against all scores in the current portfolio.", unsafe_allow_html=True)
-        st.divider()
-        st.write("__Target KPIs:__ Target KPI values to go up to the next level of supply chain strength. For example, :orange[MEDIUM] > :green[HIGH].")
-        st.divider()
-        st.write("__Target Supply Chain Strength:__ How strong the supply chain for that supplier would be if you made one of the suggested changes.")
-        st.write("")
-    st.metric("","")
-
-    st.subheader("Current KPIs", anchor=None, help=None, divider="grey")
+    # Fragility Index and Natural Disaster Risk come from the local snapshot, so no network access is needed here
+    with instrumentation.span("country_risk_lookup"):
+        input9, input10 = country_risk.lookup_country(input6, country_risk.get_snapshot(auto_refresh=True))
 
-    c1, c2, c3 = st.columns(3)
-    c1.metric("Lead Time", f"{input1} days")
-    c2.metric("Distance", f"{input2:.1f} km")
-    c3.metric("BCP Risk", input3)
 
-    c4, c5 = st.columns(2)
-    c4.metric(f"Fragility Index for :blue[{input6}]", input9)
-    c5.metric(f"Natural Disaster Risk for :blue[{input6}]", f"{input10:.1f}%")
+    with instrumentation.span("rendering"):
+        st.metric("","")
 
-    st.metric("","")
+        with st.expander("See Explanation"):
+            st.divider()
+            st.write("__Current KPIs:__ Current values for all 5 introduced KPIs.")
+            st.divider()
+            st.write("__Current Supply Chain Strength:__ (:green[HIGH], :orange[MEDIUM] or :red[LOW]) How strong the current supply chain is, with a percentage orientation that ranks the result against all scores in the current portfolio.", unsafe_allow_html=True)
+            st.divider()
+            st.write("__Target KPIs:__ Target KPI values to go up to the next level of supply chain strength. For example, :orange[MEDIUM] > :green[HIGH].")
+            st.divider()
+            st.write("__Target Supply Chain Strength:__ How strong the supply chain for that supplier would be if you made one of the suggested changes.")
+            st.write("")
+        st.metric("","")
+
+        st.subheader("Current KPIs", anchor=None, help=None, divider="grey")
+
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Lead Time", f"{input1} days")
+        c2.metric("Distance", f"{input2:.1f} km")
+        c3.metric("BCP Risk", input3)
+
+        c4, c5 = st.columns(2)
+        c4.metric(f"Fragility Index for :blue[{input6}]", f"{input9:.1f}")
+        c5.metric(f"Natural Disaster Risk for :blue[{input6}]", f"{input10:.1f}%")
+
+        st.metric("","")
 
 
 
     # Convert BCP_risk to numerical values
-    bcp_mapping = {"LOW": 0, "MEDIUM": 1, "HIGH": 2}
+    bcp_mapping = scoring.BCP_MAPPING
 
     df0 = pd.DataFrame({
         'Lead Time': [input1],
@@ -163,24 +187,30 @@ def run_script(input1, input2, input3, input6):
 
     # df1 = pd.DataFrame(data)
     
-    df1 = pd.read_excel(r"streamlit_data_for_scaler.xlsx")
-    df = pd.concat([df0, df1], ignore_index=True)
+    # Scale against the persisted reference model, so the simulated supplier does not shift the statistics it is scored against
+    with instrumentation.span("scaling"):
+        mean, scale = scaler_model.model_scaler(scaler_model.get_model())
+        df = df0
 
-    scaler = StandardScaler()
-    df[["Lead_Time_T", "Distance_T", "Fragility_Index_T", "Natural_Disaster_Risk_T", "BCP_Risk_T"]] = scaler.fit_transform(df[["Lead Time", "Distance (km)", "Fragility Index", "Natural Disaster Risk", "BCP_risk"]])
+        X = scoring.feature_matrix(df)
+        df[scoring.SCALED_FEATURES] = scoring.transform(X, mean, scale)
 
     #============== ACTUAL TOOL ==============#
-    # Weights
-    leadtime_weight = 0.205
-    distance_weight = 0.117
-    fragilityindex_weight = 0.042
-    naturaldisasterrisk_weight = 0.042
-    bcprisk_weight = 0.595
+    # Weights of the AHP profile selected on the Weight Calculation page
+    weights = active_weights()
+    with instrumentation.span("scoring"):
+        df["SCR_score"] = scoring.score(df[scoring.SCALED_FEATURES].to_numpy(), weights)
 
-    df["SCR_score"] = -(leadtime_weight * df['Lead_Time_T']) - (distance_weight * df['Distance_T']) - (fragilityindex_weight * df['Fragility_Index_T']) - (naturaldisasterrisk_weight * df['Natural_Disaster_Risk_T']) - (bcprisk_weight * df['BCP_Risk_T'])
+        # Scores 0, 1 or 2 for SCR
+        df['SCR_Strength'] = scoring.strength(df["SCR_score"].to_numpy())
 
-    # Scores 0, 1 or 2 for SCR
-    df['SCR_Strength'] = df['SCR_score'].apply(lambda x: 0 if x <= -0.75 else (1 if -0.75 < x < -0.19 else 2))
+    # Scored reference portfolio and its sorted score index, built on the first simulation and cached afterwards
+    with instrumentation.span("portfolio_load"):
+        score_index = portfolio.get_score_index(weights=weights)
+
+    # Percentile rank of the simulated score within the portfolio, from the precomputed sorted score index
+    with instrumentation.span("scoring"):
+        supply_chain_strength_percentage = float(score_index.percentile(df.loc[0, 'SCR_score']))
 
     # selected_columns = df.loc[:, ['Lead Time', 'Distance (km)', 'Fragility Index', 'Natural Disaster Risk', 'BCP_risk', 'Lead_Time_T', 'Distance_T', 'Fragility_Index_T', 'Natural_Disaster_Risk_T', 'BCP_Risk_T', 'SCR_score', 'SCR_Strength']]
     # st.dataframe(selected_columns)
@@ -191,44 +221,27 @@ def run_script(input1, input2, input3, input6):
     # st.write("SCR_Strength for the first row:", df.loc[0, 'SCR_Strength'])
 
     # Display the corresponding label for "SCR_Strength" for the first row
-    strength_labels = {0: 'LOW', 1: 'MEDIUM', 2: 'HIGH'}
-
-    st.subheader("Current Supply Chain Strength", anchor=None, help=None, divider="grey")
-
-    c6, c7 = st.columns(2)
-    if df.loc[0, 'SCR_Strength'] == 0:
-        c6.metric(":red_circle: :red[Supply Chain Strength]", strength_labels[0])
-    elif df.loc[0, 'SCR_Strength'] == 1:
-        c6.metric(":large_orange_circle: :orange[Supply Chain Strength]", strength_labels[1])
-    else:
-        c6.metric(":large_green_circle: :green[Supply Chain Strength]", strength_labels[2])
-
+    strength_labels = scoring.STRENGTH_LABELS
 
+    with instrumentation.span("rendering"):
+        st.subheader("Current Supply Chain Strength", anchor=None, help=None, divider="grey")
 
+        c6, c7 = st.columns(2)
+        if df.loc[0, 'SCR_Strength'] == 0:
+            c6.metric(":red_circle: :red[Supply Chain Strength]", strength_labels[0])
+        elif df.loc[0, 'SCR_Strength'] == 1:
+            c6.metric(":large_orange_circle: :orange[Supply Chain Strength]", strength_labels[1])
+        else:
+            c6.metric(":large_green_circle: :green[Supply Chain Strength]", strength_labels[2])
 
-
-
-
-    df_score = df['SCR_score']
-    # Progress bar based on SCR_score
-    progress_value = df.loc[0, 'SCR_score']
-    progress_min = df1['SCR_score'].min()
-    progress_max = df1['SCR_score'].max()
-    if progress_max > progress_value and progress_min < progress_value:
-        supply_chain_strength_percentage = abs(progress_value - progress_min) / abs(progress_max - progress_min)
-    else:
-        # Set supply_chain_strength_percentage to 0 if progress_value < progress_min
-        # Set supply_chain_strength_percentage to 1 if progress_value > progress_max
-        supply_chain_strength_percentage = 0 if progress_value < progress_min else 1
-
-    if df.loc[0, 'SCR_Strength'] == 0:
-        c7.metric(":red_circle: :red[Supply Chain Strength as a Percentage]", f"{supply_chain_strength_percentage:.1%}")
-    elif df.loc[0, 'SCR_Strength'] == 1:
-        c7.metric(":large_orange_circle: :orange[Supply Chain Strength as a Percentage]", f"{supply_chain_strength_percentage:.1%}")
-    else:
-        c7.metric(":large_green_circle: :green[Supply Chain Strength as a Percentage]", f"{supply_chain_strength_percentage:.1%}")  
+        if df.loc[0, 'SCR_Strength'] == 0:
+            c7.metric(":red_circle: :red[Supply Chain Strength as a Percentage]", f"{supply_chain_strength_percentage:.1%}")
+        elif df.loc[0, 'SCR_Strength'] == 1:
+            c7.metric(":large_orange_circle: :orange[Supply Chain Strength as a Percentage]", f"{supply_chain_strength_percentage:.1%}")
+        else:
+            c7.metric(":large_green_circle: :green[Supply Chain Strength as a Percentage]", f"{supply_chain_strength_percentage:.1%}")  
     
-    st.metric("","")
+        st.metric("","")
     
 
 
@@ -250,43 +263,13 @@ def run_script(input1, input2, input3, input6):
 
    
     # ======= Change in criteria required ======== #
-    # LeadTime
-    df['Lead Time Required Scaled'] = df.apply(lambda row: ((-0.75) - (-distance_weight * row['Distance_T'] - fragilityindex_weight * row['Fragility_Index_T'] - naturaldisasterrisk_weight * row['Natural_Disaster_Risk_T'] - bcprisk_weight * row['BCP_Risk_T'])) / (-leadtime_weight) if row['SCR_Strength'] == 0 else (((-0.19) - (-distance_weight * row['Distance_T'] - fragilityindex_weight * row['Fragility_Index_T'] - naturaldisasterrisk_weight * row['Natural_Disaster_Risk_T'] - bcprisk_weight * row['BCP_Risk_T'])) / (-leadtime_weight) if row['SCR_Strength'] == 1 else ""), axis=1)
-    # Distance
-    df['Distance Required Scaled'] = df.apply(lambda row: ((-0.75) - (-leadtime_weight * row['Lead_Time_T'] - fragilityindex_weight * row['Fragility_Index_T'] - naturaldisasterrisk_weight * row['Natural_Disaster_Risk_T'] - bcprisk_weight * row['BCP_Risk_T'])) / (-distance_weight) if row['SCR_Strength'] == 0 else (((-0.19) - (-leadtime_weight * row['Lead_Time_T'] - fragilityindex_weight * row['Fragility_Index_T'] - naturaldisasterrisk_weight * row['Natural_Disaster_Risk_T'] - bcprisk_weight * row['BCP_Risk_T'])) / (-distance_weight) if row['SCR_Strength'] == 1 else ""), axis=1)
-    # Fragility
-    df['Fragility Required Scaled'] = df.apply(lambda row: ((-0.75) - (-distance_weight * row['Distance_T'] - leadtime_weight * row['Lead_Time_T'] - naturaldisasterrisk_weight * row['Natural_Disaster_Risk_T'] - bcprisk_weight * row['BCP_Risk_T'])) / (-fragilityindex_weight) if row['SCR_Strength'] == 0 else (((-0.19) - (-distance_weight * row['Distance_T'] - leadtime_weight * row['Lead_Time_T'] - naturaldisasterrisk_weight * row['Natural_Disaster_Risk_T'] - bcprisk_weight * row['BCP_Risk_T'])) / (-fragilityindex_weight) if row['SCR_Strength'] == 1 else ""), axis=1)
-    # Natural Disaster Risk
-    df['Natural Disaster Required Scaled'] = df.apply(lambda row: ((-0.75) - (-distance_weight * row['Distance_T'] - fragilityindex_weight * row['Fragility_Index_T'] - leadtime_weight * row['Lead_Time_T'] - bcprisk_weight * row['BCP_Risk_T'])) / (-naturaldisasterrisk_weight) if row['SCR_Strength'] == 0 else (((-0.19) - (-distance_weight * row['Distance_T'] - fragilityindex_weight * row['Fragility_Index_T'] - leadtime_weight * row['Lead_Time_T'] - bcprisk_weight * row['BCP_Risk_T'])) / (-naturaldisasterrisk_weight) if row['SCR_Strength'] == 1 else ""), axis=1)
-    # BCP Risk
-    df['BCP Risk Required Scaled'] = df.apply(lambda row: ((-0.75) - (-distance_weight * row['Distance_T'] - fragilityindex_weight * row['Fragility_Index_T'] - naturaldisasterrisk_weight * row['Natural_Disaster_Risk_T'] - leadtime_weight * row['Lead_Time_T'])) / (-bcprisk_weight) if row['SCR_Strength'] == 0 else (((-0.19) - (-distance_weight * row['Distance_T'] - fragilityindex_weight * row['Fragility_Index_T'] - naturaldisasterrisk_weight * row['Natural_Disaster_Risk_T'] - leadtime_weight * row['Lead_Time_T'])) / (-bcprisk_weight) if row['SCR_Strength'] == 1 else ""), axis=1)
-
-    # df1 = df[df['Lead Time Required Scaled'] != ""]
+    # Only the simulated supplier (row 0) is displayed, so only that row is solved
+    with instrumentation.span("target_solving"):
+        required_scaled, required, bcp_with_negative = targets.solve_targets(df[scoring.SCALED_FEATURES].to_numpy(), df["SCR_score"].to_numpy(), df["SCR_Strength"].to_numpy(), mean, scale, weights, scoring.THRESHOLDS, rows=[0])
 
-    # Convert empty strings to NaN in the required scaled columns
-    df['Lead Time Required Scaled'] = pd.to_numeric(df['Lead Time Required Scaled'], errors='coerce')
-    df['Distance Required Scaled'] = pd.to_numeric(df['Distance Required Scaled'], errors='coerce')
-    df['Fragility Required Scaled'] = pd.to_numeric(df['Fragility Required Scaled'], errors='coerce')
-    df['Natural Disaster Required Scaled'] = pd.to_numeric(df['Natural Disaster Required Scaled'], errors='coerce')
-    df['BCP Risk Required Scaled'] = pd.to_numeric(df['BCP Risk Required Scaled'], errors='coerce')
-
-    # Reverse the scaling for all criteria
-    df[['Lead Time Required', 'Distance Required', 'Fragility Required', 'Natural Disaster Required', 'BCP Risk Required']] = scaler.inverse_transform(df[['Lead Time Required Scaled', 'Distance Required Scaled', 'Fragility Required Scaled', 'Natural Disaster Required Scaled', 'BCP Risk Required Scaled']])
-
-    # Pone un "0" si es negativo y deja el valor como esta (x) si es positivo.
-    df['Distance Required'][df['Distance Required'] < 0] = 0
-    df['Lead Time Required'][df['Lead Time Required'] < 0] = 0
-    df['Fragility Required'][df['Fragility Required'] < 0] = 0
-    df['Natural Disaster Required'][df['Natural Disaster Required'] < 0] = 0
-    # df['BCP Risk Required'][df['BCP Risk Required'] < 0] = -1
-
-    # Round down BCP Risk Required to nearest whole number.
-    df['BCP Risk Required'] = df['BCP Risk Required'].apply(lambda x: math.floor(x) if x >= 0 else 0)
-
-    # Assuming AB2 is a variable 'bcprisk_required_scaled' and AG2 is a variable 'bcprisk_required'.  -0.956438593999987 is the scaled value for BCP_Risk = 0.
-    df['BCP Risk Required with negative'] = np.where(df['BCP Risk Required Scaled'] < -0.956438593999987, -1, df['BCP Risk Required'])
-
-    # st.dataframe(df)
+    df_targets = pd.DataFrame(required, columns=scoring.REQUIRED)
+    df_targets['BCP Risk Required with negative'] = bcp_with_negative
+    df_targets['SCR_Strength'] = df.loc[[0], 'SCR_Strength'].to_numpy()
 
 
     def display_kpi_cards(df):
@@ -345,14 +328,138 @@ def run_script(input1, input2, input3, input6):
 
 
     # Call the display_kpi_cards function with the DataFrame
-    display_kpi_cards(df)
+    with instrumentation.span("rendering"):
+        display_kpi_cards(df_targets)
+
+    if uncertainty is not None:
+        render_uncertainty_results(input1, input2, input3, input9, input10, uncertainty, (mean, scale), weights)
+
+
+# Function to render the Monte Carlo results for the simulated supplier
+def render_uncertainty_results(input1, input2, input3, input9, input10, uncertainty, scaler, weights):
+    import montecarlo
+
+    spec = {
+        "Lead Time": {"dist": "normal", "mean": input1, "std": uncertainty["lead_time_std"]},
+        "Distance (km)": {"dist": "normal", "mean": input2, "std": uncertainty["distance_std"]},
+        "Fragility Index": {"dist": "normal", "mean": input9, "std": input9 * uncertainty["country_risk_std"]},
+        "Natural Disaster Risk": {"dist": "normal", "mean": input10, "std": input10 * uncertainty["country_risk_std"]},
+        "BCP_risk": input3,
+    }
+    with instrumentation.span("monte_carlo"):
+        result = montecarlo.simulate_supplier(spec, scaler, weights=weights)
+    instrumentation.size("monte_carlo_samples", result["samples"])
+
+    with instrumentation.span("rendering"):
+        st.subheader("Supply Chain Strength under Uncertainty", anchor=None, help=f"Based on {result['samples']:,} random draws of the KPIs, with {montecarlo.DEFAULT_CONFIDENCE:.0%} intervals.", divider="grey")
+        c13, c14, c15 = st.columns(3)
+        c13.metric(":red_circle: :red[Probability LOW]", f"{result['P(LOW)']:.1%}")
+        c14.metric(":large_orange_circle: :orange[Probability MEDIUM]", f"{result['P(MEDIUM)']:.1%}")
+        c15.metric(":large_green_circle: :green[Probability HIGH]", f"{result['P(HIGH)']:.1%}")
+
+        c16, c17, c18 = st.columns(3)
+        c16.metric("Score interval", f"{result['SCR_score low']:.2f} to {result['SCR_score high']:.2f}")
+        if result["P(HIGH)"] < 1:
+            # Same convention as the Target KPIs: 0 means the KPI alone cannot reach the next band
+            c17.metric("Lead Time Required interval", "-" if result['Lead Time Required high'] == 0 else f"{result['Lead Time Required low']:.1f} to {result['Lead Time Required high']:.1f} days")
+            c18.metric("Distance Required interval", "-" if result['Distance Required high'] == 0 else f"{result['Distance Required low']:.1f} to {result['Distance Required high']:.1f} km")
+
+
+# Name of the AHP weight profile used for scoring in this session
+def active_profile():
+    import ahp
+
+    profile = st.session_state.get("ahp_profile", ahp.DEFAULT_PROFILE)
+    return profile if profile in ahp.load_profiles() else ahp.DEFAULT_PROFILE
+
+
+def active_weights():
+    # Kept in the session per selected profile, so reruns neither re-read the profiles file nor re-solve the matrix;
+    # dropped when a profile is saved, since that may overwrite the selected one
+    selected = st.session_state.get("ahp_profile")
+    cached = st.session_state.get("ahp_weights")
+    if cached is None or cached[0] != selected:
+        import ahp
+
+        cached = (selected, ahp.get_weights(active_profile()))
+        st.session_state["ahp_weights"] = cached
+    return cached[1]
 
 
 def render_ahp_page():
+    import numpy as np
+    import ahp
+    import portfolio
+    import scoring
+
     st.title("Weight Calculation")
     st.write("This section describes the process followed to calculate the weights asigned to each KPI prior to calculating the Supply Chain Strength for a given supplier.")
     st.header("AHP Matrix", anchor=None, help="For more information about the matrix construction process, check out the Wikipedia article below.", divider="grey")
-    st.image('AHP.png')
+
+    profiles = ahp.load_profiles()
+    names = list(profiles)
+    profile_name = st.selectbox("__Weight profile__", names, index=names.index(active_profile()), help=f"The :blue[{ahp.DEFAULT_PROFILE}] profile is the matrix below, used for the original weights.")
+    profile = profiles[profile_name]
+
+    uploaded = st.file_uploader("Load a comparison matrix", type=["csv", "json"], help="A 5 x 5 matrix of the KPIs, as CSV (KPI names as header and first column, in any order) or JSON (in the order shown).")
+    matrix = profile["matrix"]
+    if uploaded is not None:
+        try:
+            matrix = ahp.read_matrix(uploaded)
+        except (ValueError, KeyError) as e:
+            st.error(f"Could not read the comparison matrix: {e}")
+
+    st.write("How much more important each row KPI is than each column KPI (1 = equal, 9 = extremely more important). Only the upper triangle is used, the lower one is filled in with reciprocals.")
+    edited = st.data_editor(ahp.matrix_frame(matrix), key=f"ahp_matrix_{profile_name}_{uploaded.name if uploaded else ''}")
+    try:
+        matrix = ahp.reciprocal_matrix(edited.to_numpy())
+        method = st.radio("Method", ahp.METHODS, index=ahp.METHODS.index(profile.get("method", "eigenvector")), horizontal=True, help="Principal eigenvector (standard AHP) or the normalised column average approximation.")
+        candidate = {"matrix": matrix.tolist(), "method": method, "decimals": profile.get("decimals") if method == profile.get("method") else None}
+        weights = ahp.profile_weights(candidate)
+        lambda_max, consistency_index, consistency_ratio = ahp.consistency(matrix)
+    except ValueError as e:
+        st.error(str(e))
+        return
+
+    st.header("Weights", anchor=None, help=None, divider="grey")
+    columns = st.columns(len(weights))
+    for column, name, weight in zip(columns, scoring.FEATURES, weights):
+        column.metric(name, f"{weight:.3f}")
+
+    c1, c2, c3 = st.columns(3)
+    c1.metric("λ max", f"{lambda_max:.3f}")
+    c2.metric("Consistency Index", f"{consistency_index:.3f}")
+    c3.metric("Consistency Ratio", f"{consistency_ratio:.1%}")
+    if consistency_ratio > ahp.MAX_CONSISTENCY_RATIO:
+        st.warning(f"The consistency ratio is above {ahp.MAX_CONSISTENCY_RATIO:.0%}, so the judgements contradict each other and should be revised.", icon="⚠️")
+
+    # Re-scoring the portfolio only needs one matrix-vector product on the already scaled KPIs
+    scores, strengths = portfolio.rescore(weights)
+    _, current_strengths = portfolio.rescore(active_weights())
+    counts = np.bincount(strengths, minlength=3)
+    st.write(f"Portfolio with these weights: :red[{counts[0]} LOW], :orange[{counts[1]} MEDIUM], :green[{counts[2]} HIGH] ({(strengths != current_strengths).sum()} suppliers change band compared with the :blue[{active_profile()}] profile).")
+
+    c4, c5 = st.columns(2)
+    if c4.button("Use for scoring", type="primary"):
+        if np.allclose(matrix, profile["matrix"], rtol=1e-6) and method == profile.get("method"):
+            st.session_state["ahp_profile"] = profile_name
+            st.rerun()
+        else:
+            st.warning("Save the edited matrix as a profile before using it for scoring.")
+    new_name = c5.text_input("Save as profile", placeholder="Profile name")
+    if c5.button("Save profile") and new_name:
+        try:
+            ahp.save_profile(new_name, matrix, method)
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            st.session_state["ahp_profile"] = new_name
+            st.session_state.pop("ahp_weights", None)
+            st.rerun()
+    st.caption(f"Scoring currently uses the :blue[{active_profile()}] profile.")
+
+    with st.expander("Original AHP matrix"):
+        st.image('AHP.png')
 
     st.header("Analytic hierarchy process", anchor=None, help=None, divider="grey")
     # Add more code specific to the Natural Disaster Risk page if needed
@@ -363,6 +470,57 @@ def render_ahp_page():
     unsafe_allow_html=True
     )
 
+# Function to render the weight and threshold sensitivity page
+def render_sensitivity_page():
+    import altair as alt
+    import numpy as np
+    import pandas as pd
+    import portfolio
+    import scoring
+    import sensitivity
+
+    st.title("Sensitivity")
+    st.write("How many suppliers in the portfolio would change Supply Chain Strength if the AHP weights or the band cut-offs were different. The whole portfolio is re-scored for every scenario.")
+
+    df_portfolio, _ = portfolio.get_scored_portfolio()
+    Z = df_portfolio[scoring.SCALED_FEATURES].to_numpy()
+    weights = active_weights()
+    st.caption(f"Using the weights of the :blue[{active_profile()}] AHP profile.")
+
+    def heatmap(df, x_title, y_title):
+        data = df.reset_index().melt(id_vars=df.index.name, var_name=df.columns.name, value_name="Suppliers changing band")
+        data[df.columns.name] = data[df.columns.name].astype(str)
+        data[df.index.name] = data[df.index.name].astype(str)
+        base = alt.Chart(data).encode(x=alt.X(f"{df.columns.name}:O", title=x_title), y=alt.Y(f"{df.index.name}:O", title=y_title))
+        rect = base.mark_rect().encode(color=alt.Color("Suppliers changing band:Q", scale=alt.Scale(scheme="orangered")), tooltip=list(data.columns))
+        text = base.mark_text().encode(text=alt.Text("Suppliers changing band:Q", format=".0f"))
+        st.altair_chart(rect + text, use_container_width=True)
+
+    st.header("AHP Weights", anchor=None, help="Each weight is changed on its own by the given percentage and the weights are renormalised to their original sum.", divider="grey")
+    max_change = st.slider("Maximum weight change (:blue[%])", min_value=10, max_value=100, value=50, step=10)
+    steps = st.slider("Steps on each side", min_value=1, max_value=10, value=5)
+    deltas = np.round(np.linspace(-max_change, max_change, 2 * steps + 1)) / 100
+    changes, _, _ = sensitivity.weight_sensitivity(Z, deltas, base_weights=weights)
+    changes.columns = pd.Index([f"{d:+.0%}" for d in deltas], name=changes.columns.name)
+    heatmap(changes, "Weight change", "KPI")
+
+    st.header("Band Cut-offs", anchor=None, help=f"Current cut-offs: LOW if SCR_score <= {scoring.THRESHOLDS[0]}, HIGH if SCR_score >= {scoring.THRESHOLDS[1]}.", divider="grey")
+    c1, c2 = st.columns(2)
+    low_range = c1.slider("LOW / MEDIUM cut-off range", min_value=-2.0, max_value=0.0, value=(-1.0, -0.5), step=0.05)
+    high_range = c2.slider("MEDIUM / HIGH cut-off range", min_value=-1.0, max_value=1.0, value=(-0.4, 0.0), step=0.05)
+    low_values = np.round(np.linspace(*low_range, 11), 3)
+    high_values = np.round(np.linspace(*high_range, 9), 3)
+    heatmap(sensitivity.threshold_sensitivity(Z, low_values, high_values, weights=weights), "MEDIUM / HIGH cut-off", "LOW / MEDIUM cut-off")
+
+    st.header("Random Weights", anchor=None, help="Weight vectors drawn from a Dirichlet distribution centred on the current weights.", divider="grey")
+    c3, c4 = st.columns(2)
+    samples = c3.number_input("Weight vectors", min_value=10, max_value=5000, value=500, step=10)
+    concentration = c4.number_input("Concentration", min_value=10.0, max_value=1000.0, value=100.0, step=10.0, help="Higher values keep the sampled weights closer to the current ones.")
+    random_results = sensitivity.random_sensitivity(Z, int(samples), concentration, base_weights=weights)
+    st.metric("Weight vectors that change at least one supplier's band", f"{(random_results['Changed band'] > 0).mean():.1%}")
+    st.bar_chart(random_results["Changed band"].value_counts().sort_index(), x_label="Suppliers changing band", y_label="Weight vectors")
+
+
 # Function to render the Fragility Index page
 def render_fragility_index_page():
     st.title("Fragility Index")
@@ -391,16 +549,55 @@ def render_natural_disaster_page():
 
 
 
+# Function to render the country risk snapshot status in the sidebar
+def render_country_risk_status():
+    snapshot = country_risk.get_snapshot()
+    with st.expander("Country risk data"):
+        fetched_at = snapshot.get("fetched_at")
+        st.caption(f"Snapshot v{snapshot.get('version')} ({snapshot.get('source')}), fetched {fetched_at[:10] if fetched_at else 'never'}")
+        # The refresh runs in a background thread; the new snapshot is picked up on the next interaction
+        if st.button("Refresh now"):
+            country_risk.refresh_in_background(force=True)
+        running, error = country_risk.refresh_status()
+        if running:
+            st.caption("Refreshing in the background...")
+        elif error:
+            st.caption(f":red[Last refresh failed, keeping the current snapshot: {error}]")
+
+
+# Function to render timings, cache hits and data sizes of this session's last simulation; the
+# process-wide recent runs would show whichever session (or the warm-up) ran last
+def render_diagnostics():
+    import pandas as pd
+
+    simulation = st.session_state.get("last_simulation")
+    if simulation is None:
+        st.caption("No simulation has run in this session yet.")
+        return
+    last = simulation.to_dict()
+    st.caption(f"Last {last['run']} run: {last['total_ms']:.1f} ms" + (f" (failed: {last['error']})" if last["error"] else ""))
+    spans = pd.DataFrame({"Stage": list(last["spans_ms"]), "ms": list(last["spans_ms"].values())})
+    st.dataframe(spans, hide_index=True)
+    if last["counters"]:
+        st.dataframe(pd.DataFrame({"Counter": list(last["counters"]), "Value": list(last["counters"].values())}), hide_index=True)
+    if last["sizes"]:
+        st.dataframe(pd.DataFrame({"Size": list(last["sizes"]), "Value": list(last["sizes"].values())}), hide_index=True)
+    st.caption(f"Metrics are appended to {instrumentation.METRICS_PATH}")
+
+
 # Main function
 def main():
     with st.sidebar:
+        # Tuples, not lists: Streamlit imports pandas to check whether a list component argument is a dataframe
         selected = option_menu(
             menu_title="Navigation",
-            options=["Simulator", "Weight Calculation", "Fragility Index", "Natural Disaster Risk"],
-            icons=["calculator", "123", "wikipedia", "wikipedia"],
+            options=("Simulator", "Weight Calculation", "Sensitivity", "Fragility Index", "Natural Disaster Risk"),
+            icons=("calculator", "123", "sliders", "wikipedia", "wikipedia"),
             menu_icon="list",
             default_index=0,
         )
+        render_country_risk_status()
+        st.toggle("Show diagnostics", key="show_diagnostics", help="Timings, cache hits and data sizes of your last simulation, shown under the Simulator.")
 
     # Render the selected page
     if selected == "Simulator":
@@ -411,6 +608,10 @@ def main():
         render_natural_disaster_page()
     elif selected == "Weight Calculation":
         render_ahp_page()
+    elif selected == "Sensitivity":
+        render_sensitivity_page()
+
+    start_warm_up()
 
 if __name__ == "__main__":
     main()
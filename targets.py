@@ -0,0 +1,37 @@
+import numpy as np
+
+
+# ======================================== TARGET KPI SOLVER ======================================================= #
+#
+# SCR_score = -sum(w_j * z_j), so holding the other four KPIs fixed, the scaled value of KPI j that puts a row exactly
+# on its next band's threshold t is
+#
+#     z_j' = (t - (SCR_score + w_j * z_j)) / -w_j
+#
+# which is solved for every row and every KPI in one broadcast array expression. Rows already in HIGH have no next
+# band and come out as NaN.
+
+
+def solve_targets(Z, scores, strengths, mean, scale, weights, thresholds, rows=None):
+    # rows restricts the solve to a subset (e.g. [0] for the simulated supplier); results are in that order
+    if rows is not None:
+        Z, scores, strengths = Z[rows], scores[rows], strengths[rows]
+
+    # Threshold of the next band per row: LOW -> MEDIUM cut-off, MEDIUM -> HIGH cut-off, HIGH -> none
+    next_threshold = np.array([thresholds[0], thresholds[1], np.nan])[strengths]
+    required_scaled = (next_threshold[:, None] - scores[:, None] - weights * Z) / -weights
+
+    required = required_scaled * scale + mean
+    # Negative lead times, distances and risk indices are not achievable, 0 means "no target"
+    np.maximum(required[:, :4], 0, out=required[:, :4], where=~np.isnan(required[:, :4]))
+
+    # BCP risk is a level, so round down. Below LOW means no BCP change is enough on its own, shown as -1.
+    bcp_raw = required[:, 4]
+    bcp_with_negative = np.where(bcp_raw < 0, -1, np.where(bcp_raw >= 0, np.floor(bcp_raw), 0))
+    required[:, 4] = np.maximum(bcp_with_negative, 0)
+    return required_scaled, required, bcp_with_negative
+
+
+def has_target(strengths):
+    # Mask of the rows that can still move up a band
+    return np.asarray(strengths) != 2